@@ -0,0 +1,1242 @@
+"""
+Benchmarks for the identity reconciliation workload.
+
+Every benchmark runs against a throwaway SQLite database, so it never
+touches the application's own database file. DATABASE_URL is ignored:
+main is imported against a throwaway database as well.
+
+Usage:
+    python bench.py merge [--sizes 10 100 1000 5000]
+    python bench.py plans
+    python bench.py statements
+    python bench.py profiles [--requests 1000] [--readers 4]
+    python bench.py writers [--clients 50] [--requests 40] [--profile default]
+    python bench.py batching [--windows 0 1 2 5 10] [--clients 50]
+    python bench.py bulk [--sizes 1 10 100 1000 10000]
+    python bench.py lookup [--requests 1000]
+    python bench.py bloom [--requests 2000] [--seeded 20000] [--capacity 100000]
+    python bench.py fastpath [--requests 2000] [--repeat-share 0.7]
+    python bench.py cache [--requests 5000] [--hot 100] [--bytes 1048576] [--identifiers 10000]
+    python bench.py alloc [--sizes 100 1000 10000] [--requests 50]
+    python bench.py timestamps [--requests 2000]
+    python bench.py engines [--requests 3000] [--identifiers 300] [--seed 1]
+    python bench.py singleflight [--requests 30] [--pairs 3]
+    python bench.py concurrency [--threads 16] [--requests 150] [--identifiers 80] [--seed 1]
+    python bench.py latency [--connections 200] [--requests 4000] [--profile wal] [--write-mode direct]
+"""
+import argparse
+import asyncio
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from typing import Iterator, List
+
+from dataclasses import replace
+
+from sqlalchemy import delete, event, func, insert, select
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+# Importing main creates its engines and schema from the environment, so
+# point it at a throwaway database first. The benchmarks themselves use
+# their own databases from temp_sessionmaker.
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='bitespeed-bench-'), 'app.db')}"
+os.environ["READ_DATABASE_URL"] = ""
+
+import main
+from main import Contact, IdentifyRequest, IdentityCluster, LinkPrecedence
+
+
+# --- Helpers ---
+
+def temp_sessionmaker(profile: str = "default", **settings) -> sessionmaker:
+    """
+    Creates an empty SQLite database in a temporary directory and returns a
+    sessionmaker bound to it, using the given storage profile and settings.
+    """
+    path = os.path.join(tempfile.mkdtemp(prefix="bitespeed-bench-"), "bench.db")
+    bench_engine = main.create_db_engine(
+        main.Settings(database_url=f"sqlite:///{path}", sqlite_profile=profile, **settings)
+    )
+    main.ensure_schema(bench_engine)
+    return sessionmaker(
+        autocommit=False, autoflush=False, expire_on_commit=False, bind=bench_engine, class_=main.ContactSession
+    )
+
+
+def seed_cluster(db, tag: str, size: int) -> int:
+    """
+    Inserts one identity group of `size` contacts (a primary plus size - 1
+    secondaries) with its materialized cluster and returns the primary id.
+    """
+    primary = Contact(email=f"{tag}-0@example.com", phoneNumber=f"{tag}-0", linkPrecedence=LinkPrecedence.primary)
+    db.add(primary)
+    db.flush()
+    if size > 1:
+        db.execute(insert(Contact), [
+            {
+                "email": f"{tag}-{i}@example.com",
+                "phoneNumber": f"{tag}-{i}",
+                "linkedId": primary.id,
+                "linkPrecedence": LinkPrecedence.secondary,
+            }
+            for i in range(1, size)
+        ])
+    db.commit()
+    main.materialize_identity_cluster(db, primary)
+    db.commit()
+    return primary.id
+
+
+def timed(fn) -> float:
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def print_table(headers: List[str], rows: Iterator[list]) -> None:
+    print(" | ".join(f"{h:>14}" for h in headers))
+    print("-+-".join("-" * 14 for _ in headers))
+    for row in rows:
+        print(" | ".join(f"{v:>14}" for v in row))
+
+
+# --- Benchmarks ---
+
+def bench_merge(sizes: List[int]) -> None:
+    """
+    Times an identify call that merges two groups of `size` contacts each,
+    which relinks every secondary of the newer group.
+    """
+    def rows():
+        for size in sizes:
+            Session = temp_sessionmaker()
+            with Session() as db:
+                seed_cluster(db, "a", size)
+                seed_cluster(db, "b", size)
+            request = IdentifyRequest(email="a-0@example.com", phoneNumber="b-0")
+            with Session() as db:
+                elapsed = timed(lambda: main.identify_contact(request, db))
+            yield [size, 2 * size, f"{elapsed * 1000:.2f}"]
+
+    print_table(["group size", "merged rows", "merge ms"], rows())
+
+
+def workload_request(i: int) -> IdentifyRequest:
+    """
+    The i-th request of the write workload: every fourth request starts a new
+    group, the next three each add a secondary with a new email.
+    """
+    return IdentifyRequest(email=f"w{i}@example.com", phoneNumber=f"p{i // 4}")
+
+
+def bench_profiles(profiles: List[str], requests: int, readers: int) -> None:
+    """
+    Measures, for each SQLite storage profile, sequential write and read
+    throughput of the identify workload, then read throughput and lock
+    errors while `readers` threads run alongside one writer thread.
+    """
+    def rows():
+        for profile in profiles:
+            Session = temp_sessionmaker(profile)
+
+            def identify(request):
+                with Session() as db:
+                    main.identify_contact(request, db)
+
+            start = time.perf_counter()
+            for i in range(requests):
+                identify(workload_request(i))
+            writes = requests / (time.perf_counter() - start)
+
+            # Repeating stored pairs carries nothing new: read-only requests
+            start = time.perf_counter()
+            for i in range(requests):
+                identify(workload_request(i))
+            reads = requests / (time.perf_counter() - start)
+
+            done = threading.Event()
+            counts = {"reads": 0, "errors": 0}
+            lock = threading.Lock()
+
+            def writer():
+                for i in range(requests, 2 * requests):
+                    try:
+                        identify(workload_request(i))
+                    except OperationalError:
+                        with lock:
+                            counts["errors"] += 1
+                done.set()
+
+            def reader(offset):
+                i = offset
+                while not done.is_set():
+                    try:
+                        identify(workload_request(i % requests))
+                        key = "reads"
+                    except OperationalError:
+                        key = "errors"
+                    with lock:
+                        counts[key] += 1
+                    i += readers
+
+            threads = [threading.Thread(target=writer)] + [
+                threading.Thread(target=reader, args=(n,)) for n in range(readers)
+            ]
+            start = time.perf_counter()
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            concurrent_reads = counts["reads"] / (time.perf_counter() - start)
+            yield [profile, f"{writes:.0f}", f"{reads:.0f}", f"{concurrent_reads:.0f}", counts["errors"]]
+
+    print_table(["profile", "writes/s", "reads/s", "reads/s +writer", "lock errors"], rows())
+
+
+def run_clients(clients: int, requests: int, identify) -> tuple:
+    """
+    Runs `clients` threads each sending `requests` workload requests through
+    identify(request). Returns (requests per second, failed requests).
+    """
+    errors = []
+
+    def client(n):
+        for i in range(requests):
+            try:
+                identify(workload_request(n * requests + i))
+            except OperationalError:
+                errors.append(n)
+
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(clients)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    return (clients * requests - len(errors)) / elapsed, len(errors)
+
+
+def serialized_sessionmakers(profile: str, clients: int) -> tuple:
+    """
+    Returns sessionmakers for the writer and, through a read-only pool sized
+    for the clients, for the request threads of a fresh database.
+    """
+    Session = temp_sessionmaker(profile)
+    read_engine = main.create_db_engine(main.Settings(
+        database_url=main.read_only_url(str(Session.kw["bind"].url)),
+        sqlite_profile=profile,
+        pool_size=clients,
+        max_overflow=0,
+    ))
+    return Session, sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=read_engine)
+
+
+def bench_writers(clients: int, requests: int, profile: str) -> None:
+    """
+    Compares direct writes from every request thread with the serialized
+    single-writer mode under `clients` concurrent clients.
+    """
+    def rows():
+        Session = temp_sessionmaker(profile, pool_size=clients, max_overflow=0)
+
+        def direct(request):
+            with Session() as db:
+                main.identify(db, request.email, request.phoneNumber)
+
+        throughput, errors = run_clients(clients, requests, direct)
+        yield ["direct", f"{throughput:.0f}", errors]
+
+        Session, ReadSession = serialized_sessionmakers(profile, clients)
+        writer = main.WriteQueue(Session)
+        writer.start()
+
+        def serialized(request):
+            with ReadSession() as db:
+                main.identify(db, request.email, request.phoneNumber, writer)
+
+        throughput, errors = run_clients(clients, requests, serialized)
+        writer.stop()
+        yield ["serialized", f"{throughput:.0f}", errors]
+
+    print_table(["write mode", "writes/s", "lock errors"], rows())
+
+
+def bench_batching(windows: List[float], clients: int, requests: int, profile: str, max_batch: int) -> int:
+    """
+    Serialized write throughput against the micro-batch window, for plain
+    /identify requests and for requests sent with an Idempotency-Key, whose
+    batches mix reconcile jobs with idempotency record stores. No job of
+    either workload fails, so no batch may be rolled back and replayed job
+    by job. Returns the number of replayed batches.
+    """
+    store = main.IdempotencyStore(3600, 1_000_000)
+
+    def rows():
+        for window in windows:
+            for workload in ("identify", "idempotent"):
+                Session, ReadSession = serialized_sessionmakers(profile, clients)
+                writer = main.WriteQueue(Session, window, max_batch)
+                writer.start()
+
+                def batched(request):
+                    with ReadSession() as db:
+                        data = main.identify(db, request.email, request.phoneNumber, writer)
+                        if workload == "idempotent":
+                            fingerprint = store.fingerprint(request.email, request.phoneNumber)
+                            store.save(db, request.email, fingerprint, data, writer)
+
+                throughput, errors = run_clients(clients, requests, batched)
+                writer.stop()
+                yield [window, workload, f"{throughput:.0f}", f"{writer.jobs / max(writer.batches, 1):.1f}",
+                       writer.replays, errors]
+
+    table = list(rows())
+    print_table(["window ms", "workload", "writes/s", "avg batch", "replayed", "lock errors"], table)
+    return sum(row[4] for row in table)
+
+
+def bench_bulk(sizes: List[int]) -> None:
+    """
+    Time of one /identify/batch call against the batch size, next to the
+    same requests sent one by one.
+    """
+    def rows():
+        for size in sizes:
+            items = [(r.email, r.phoneNumber) for r in map(workload_request, range(size))]
+
+            Session = temp_sessionmaker()
+            start = time.perf_counter()
+            for email, phone_number in items:
+                with Session() as db:
+                    main.identify(db, email, phone_number)
+            single = time.perf_counter() - start
+
+            Session = temp_sessionmaker()
+            with Session() as db:
+                bulk = timed(lambda: main.identify_batch(db, items))
+            yield [size, f"{size / single:.0f}", f"{size / bulk:.0f}", f"{1e6 * bulk / size:.0f}"]
+
+    print_table(["batch size", "single req/s", "batch req/s", "batch us/item"], rows())
+
+
+def bench_lookup(requests: int) -> None:
+    """
+    Throughput of GET /contacts/resolve next to /identify for the same
+    requests: stored pairs, a new email on a stored phone number (identify
+    inserts a secondary) and unknown identifiers (identify inserts a primary).
+    """
+    kinds = {
+        "stored pair": workload_request,
+        "new email": lambda i: IdentifyRequest(email=f"n{i}@example.com", phoneNumber=f"p{i // 4}"),
+        "unknown": lambda i: IdentifyRequest(email=f"u{i}@example.com", phoneNumber=f"u{i}"),
+    }
+
+    def rows():
+        for kind, make_request in kinds.items():
+            throughput = []
+            for endpoint in (main.identify_contact, main.resolve_contacts):
+                Session = temp_sessionmaker()
+                with Session() as db:
+                    main.identify_batch(db, [(r.email, r.phoneNumber) for r in map(workload_request, range(requests))])
+                batch = [make_request(i) for i in range(requests)]
+
+                def run():
+                    for request in batch:
+                        with Session() as db:
+                            try:
+                                endpoint(request, db)
+                            except main.HTTPException:
+                                pass  # 404 for unknown identifiers
+
+                throughput.append(f"{requests / timed(run):.0f}")
+            yield [kind, *throughput]
+
+    print_table(["request", "identify req/s", "resolve req/s"], rows())
+
+
+def bench_cache(requests: int, hot: int, cache_bytes: int, identifiers: int) -> None:
+    """
+    Throughput and SQL statements per request of repeated requests for `hot`
+    stored identity groups and for `hot` unknown identifiers, without caches,
+    with the response cache and with both the response and identifier caches.
+    """
+    seeded = 4 * hot
+    workloads = {
+        "hot /identify": (main.identify_contact, [workload_request(4 * (i % hot) + 3) for i in range(requests)]),
+        "hot /resolve": (main.resolve_contacts, [workload_request(4 * (i % hot) + 3) for i in range(requests)]),
+        "unknown /resolve": (main.resolve_contacts, [
+            IdentifyRequest(email=f"u{i % hot}@example.com", phoneNumber=f"u{i % hot}") for i in range(requests)
+        ]),
+    }
+    caches = {
+        "none": (0, 0),
+        "responses": (cache_bytes, 0),
+        "both": (cache_bytes, identifiers),
+    }
+
+    def rows():
+        for name, (response_bytes, identifier_entries) in caches.items():
+            for workload, (endpoint, batch) in workloads.items():
+                Session = temp_sessionmaker()
+                with Session() as db:
+                    main.identify_batch(db, [(r.email, r.phoneNumber) for r in map(workload_request, range(seeded))])
+                main.response_cache = main.ResponseCache(response_bytes)
+                main.identifier_cache = main.IdentifierCache(identifier_entries, 60.0)
+                statements = []
+                event.listen(Session.kw["bind"], "before_cursor_execute", lambda *args: statements.append(1))
+
+                def run():
+                    for request in batch:
+                        with Session() as db:
+                            try:
+                                endpoint(request, db)
+                            except main.HTTPException:
+                                pass  # 404 for unknown identifiers
+
+                elapsed = timed(run)
+                yield [name, workload, f"{requests / elapsed:.0f}", f"{len(statements) / requests:.2f}"]
+
+    print_table(["caches", "requests", "req/s", "statements/req"], rows())
+
+
+def bench_bloom(requests: int, seeded: int, capacity: int) -> None:
+    """
+    Campaign traffic: /identify requests whose identifiers were never seen,
+    against `seeded` stored contacts, without and with the Bloom filter.
+    """
+    batch = [IdentifyRequest(email=f"new{i}@example.com", phoneNumber=f"new{i}") for i in range(requests)]
+
+    def rows():
+        for filter_capacity in (0, capacity):
+            Session = temp_sessionmaker()
+            with Session() as db:
+                main.identify_batch(db, [(r.email, r.phoneNumber) for r in map(workload_request, range(seeded))])
+                main.identifier_filter = main.IdentifierFilter(filter_capacity, 0.01)
+                if filter_capacity:
+                    main.identifier_filter.rebuild(db)
+            selects = []
+            event.listen(
+                Session.kw["bind"], "before_cursor_execute",
+                lambda conn, cursor, statement, *args: selects.append(1) if statement.startswith("SELECT") else None,
+            )
+
+            def run():
+                for request in batch:
+                    with Session() as db:
+                        main.identify_contact(request, db)
+
+            elapsed = timed(run)
+            stats = main.identifier_filter.snapshot()
+            yield [
+                filter_capacity, f"{requests / elapsed:.0f}", f"{len(selects) / requests:.2f}",
+                stats["bytes"], f"{stats['estimatedFpRate']:.4f}",
+            ]
+
+    print_table(["capacity", "req/s", "SELECTs/req", "filter bytes", "est. FP rate"], rows())
+
+
+def bench_fastpath(requests: int, repeat_share: float) -> None:
+    """
+    A mixed /identify workload in which `repeat_share` of the requests repeat
+    a stored (email, phoneNumber) pair and the rest extend stored groups:
+    throughput, statements and transactions per request, and the share of
+    requests answered by each path.
+    """
+    Session = temp_sessionmaker()
+    with Session() as db:
+        main.identify_batch(db, [(r.email, r.phoneNumber) for r in map(workload_request, range(requests))])
+    main.identify_metrics = main.IdentifyMetrics()
+    counts = {"statements": 0, "commits": 0}
+    bench_engine = Session.kw["bind"]
+    event.listen(bench_engine, "before_cursor_execute", lambda *args: counts.update(statements=counts["statements"] + 1))
+    event.listen(bench_engine, "commit", lambda conn: counts.update(commits=counts["commits"] + 1))
+
+    batch = [
+        workload_request(i) if (i * 7919 % 100) < 100 * repeat_share
+        else IdentifyRequest(email=f"x{i}@example.com", phoneNumber=f"p{i // 4}")
+        for i in range(requests)
+    ]
+
+    def run():
+        for request in batch:
+            with Session() as db:
+                main.identify_contact(request, db)
+
+    elapsed = timed(run)
+    stats = main.identify_metrics.snapshot()
+    print(f"{requests / elapsed:.0f} req/s, {counts['statements'] / requests:.2f} statements/req, "
+          f"{counts['commits'] / requests:.2f} commits/req")
+    print_table(["path", "requests", "percent"], (
+        [path, stats["paths"][path], f"{stats['percent'][path]:.1f}"] for path in main.IdentifyMetrics.PATHS
+    ))
+
+
+def traced_peak(fn) -> int:
+    """
+    Peak bytes allocated by one call of fn beyond what was allocated before.
+    """
+    tracemalloc.start()
+    try:
+        base = tracemalloc.get_traced_memory()[0]
+        fn()
+        return tracemalloc.get_traced_memory()[1] - base
+    finally:
+        tracemalloc.stop()
+
+
+def bench_alloc(sizes: List[int], requests: int) -> None:
+    """
+    Peak allocation and time of one rendered response for a stored pair of a
+    cluster of `size` contacts: /identify and /contacts/resolve reading the
+    cluster row, and /identify answered by the identity index. Also the
+    memory retained by the index for the cluster.
+    """
+    def rows():
+        for size in sizes:
+            Session = temp_sessionmaker()
+            with Session() as db:
+                seed_cluster(db, "a", size)
+            request = IdentifyRequest(email=f"a-{size // 2}@example.com", phoneNumber=f"a-{size // 2}")
+            main.identity_index = main.IdentityIndex()
+
+            def call(endpoint):
+                with Session() as db:
+                    return endpoint(request, db)
+
+            row = [size]
+            for endpoint in (main.identify_contact, main.resolve_contacts, None):
+                if endpoint is None:
+                    endpoint = main.identify_contact
+                    with Session() as db:
+                        row.append(f"{traced_peak(lambda: main.identity_index.rebuild(db)) / 1024:.0f}")
+                call(endpoint)
+                peak = traced_peak(lambda: call(endpoint))
+                elapsed = timed(lambda: [call(endpoint) for _ in range(requests)])
+                row += [f"{peak / 1024:.0f}", f"{elapsed / requests * 1000:.2f}"]
+            main.identity_index = main.IdentityIndex()
+            yield row
+
+    print_table([
+        "cluster size", "identify KiB", "identify ms", "resolve KiB", "resolve ms",
+        "index KiB", "indexed KiB", "indexed ms",
+    ], rows())
+
+
+def bench_etag(sizes: List[int], requests: int) -> None:
+    """
+    GET /contacts/resolve of a cluster of `size` contacts: without caches,
+    then with the response and identifier caches (pre-rendered bodies, no
+    SQL), then revalidated with If-None-Match (an empty 304).
+    """
+    def rows():
+        for size in sizes:
+            Session = temp_sessionmaker()
+            with Session() as db:
+                seed_cluster(db, "a", size)
+            request = IdentifyRequest(email=f"a-{size // 2}@example.com")
+            row = [size]
+            for response_bytes, identifier_entries, revalidate in ((0, 0, False), (1 << 28, 1000, False), (1 << 28, 1000, True)):
+                main.response_cache = main.ResponseCache(response_bytes)
+                main.identifier_cache = main.IdentifierCache(identifier_entries, 60.0)
+                with Session() as db:
+                    etag = main.resolve_contacts(request, db).headers["ETag"]
+
+                def call():
+                    with Session() as db:
+                        return main.resolve_contacts(request, db, etag if revalidate else None)
+
+                response = call()
+                elapsed = timed(lambda: [call() for _ in range(requests)])
+                row += [response.status_code, len(response.body), f"{elapsed / requests * 1000:.3f}"]
+            yield row
+
+    print_table([
+        "cluster size", "status", "bytes", "uncached ms", "status", "bytes", "cached ms", "status", "bytes", "304 ms",
+    ], rows())
+
+
+def bench_timestamps(requests: int) -> None:
+    """
+    Inserts `requests` new primaries through /identify in the configured
+    TIMESTAMP_MODE: throughput, the columns each INSERT reads back and the
+    share of contacts whose createdAt ties with another contact's (ties
+    leave primary election to the id).
+    """
+    Session = temp_sessionmaker()
+    returning = set()
+
+    def capture(conn, cursor, statement, *args):
+        if statement.startswith("INSERT INTO contact"):
+            returning.add(statement.partition(" RETURNING ")[2] or "-")
+
+    event.listen(Session.kw["bind"], "before_cursor_execute", capture)
+    batch = [IdentifyRequest(email=f"t{i}@example.com", phoneNumber=f"t{i}") for i in range(requests)]
+
+    def run():
+        for request in batch:
+            with Session() as db:
+                main.identify_contact(request, db)
+
+    elapsed = timed(run)
+    with Session() as db:
+        groups = (
+            select(func.count().label("size"))
+            .select_from(Contact)
+            .group_by(Contact.createdAt)
+            .having(func.count() > 1)
+            .subquery()
+        )
+        tied = db.scalar(select(func.coalesce(func.sum(groups.c.size), 0)))
+    print_table(["timestamp mode", "req/s", "RETURNING", "tied createdAt %"], [[
+        main.settings.timestamp_mode, f"{requests / elapsed:.0f}", ", ".join(sorted(returning)),
+        f"{100 * tied / requests:.1f}",
+    ]])
+
+
+def serve_app(port: int, database_path: str, **settings) -> subprocess.Popen:
+    """
+    Starts the app under uvicorn on a throwaway database, with the given
+    settings as environment variables, and waits until it accepts requests.
+    """
+    env = {**os.environ, "DATABASE_URL": f"sqlite:///{database_path}"}
+    env.update({name.upper(): str(value) for name, value in settings.items()})
+    server = subprocess.Popen(
+        # A keep-alive timeout beyond the slowest request, so the server does
+        # not close connections the client is about to reuse
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning",
+         "--timeout-keep-alive", "120"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+        # Failed requests are counted by the client
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+            return server
+        except OSError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError("the app did not start")
+
+
+async def drive_http(port: int, connections: int, requests: int) -> tuple:
+    """
+    Sends the workload requests to /identify over `connections` concurrent
+    connections. Returns (per-request latencies in seconds, failed requests,
+    elapsed seconds).
+    """
+    import httpx
+
+    latencies = []
+    failures = 0
+    next_request = iter(range(requests))
+    limits = httpx.Limits(max_connections=connections, max_keepalive_connections=connections)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=60) as client:
+        async def connection():
+            nonlocal failures
+            for i in next_request:
+                start = time.perf_counter()
+                try:
+                    response = await client.post("/identify", json=workload_request(i).model_dump())
+                    failures += response.status_code != 200
+                except httpx.HTTPError:
+                    # e.g. the server dropping the connection of a request
+                    # that failed with "database is locked"
+                    failures += 1
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(connection() for _ in range(connections)))
+        return latencies, failures, time.perf_counter() - start
+
+
+def bench_latency(connections: int, requests: int, profile: str, write_mode: str) -> None:
+    """
+    Latency percentiles of /identify served by the sync endpoint (threadpool)
+    and by the async endpoint (async_db), each in its own uvicorn process, at
+    `connections` concurrent connections.
+    """
+    def rows():
+        for async_db in (False, True):
+            with socket.socket() as probe:
+                probe.bind(("127.0.0.1", 0))
+                port = probe.getsockname()[1]
+            path = os.path.join(tempfile.mkdtemp(prefix="bitespeed-bench-"), "bench.db")
+            server = serve_app(port, path, sqlite_profile=profile, write_mode=write_mode, async_db=async_db)
+            try:
+                latencies, failures, elapsed = asyncio.run(drive_http(port, connections, requests))
+            finally:
+                server.terminate()
+                server.wait()
+            latencies.sort()
+            ms = lambda q: f"{1000 * latencies[min(len(latencies) - 1, int(q * len(latencies)))]:.1f}"
+            yield ["async" if async_db else "sync", f"{requests / elapsed:.0f}", ms(0.5), ms(0.95), ms(0.99), failures]
+
+    print_table(["endpoint", "req/s", "p50 ms", "p95 ms", "p99 ms", "errors"], rows())
+
+
+def engine_workload(requests: int, identifiers: int, seed: int) -> List[tuple]:
+    """
+    Random (email, phoneNumber) requests over a small identifier space, so
+    that new primaries, new secondaries, repeats and merges all occur.
+    """
+    rng = random.Random(seed)
+    items = []
+    for _ in range(requests):
+        email = f"e{rng.randrange(identifiers)}@example.com"
+        phone_number = f"p{rng.randrange(identifiers)}"
+        shape = rng.random()
+        items.append((email, None) if shape < 0.2 else (None, phone_number) if shape < 0.4 else (email, phone_number))
+    return items
+
+
+class FollowerIndex(main.IdentityIndex):
+    """
+    An identity index that follows committed changes like the real one but
+    never answers lookups, so the requests replayed alongside it take their
+    usual database paths.
+    """
+
+    def lookup(self, email, phone_number):
+        return None
+
+
+def index_rows(index: main.IdentityIndex) -> List[tuple]:
+    return sorted(
+        (root, list(group.emails), list(group.phones), sorted(group.secondary_ids))
+        for root, group in index.groups.items()
+    )
+
+
+def order_mismatches(db, clusters: list, follower: main.IdentityIndex) -> int:
+    """
+    Checks that identifiers are in creation order everywhere: the cluster
+    rows maintained incrementally, the index that followed the commits and a
+    freshly rebuilt index must all equal what rebuild_identity_clusters
+    writes. Clusters deleted to simulate legacy groups and never touched
+    again are skipped. Returns the number of disagreeing groups.
+    """
+    rebuilt_index = main.IdentityIndex()
+    rebuilt_index.rebuild(db)
+    main.rebuild_identity_clusters(db)
+    rebuilt = {row[0]: tuple(row) for row in db.execute(
+        select(IdentityCluster.primaryId, IdentityCluster.emails, IdentityCluster.phoneNumbers,
+               IdentityCluster.secondaryContactIds)
+    )}
+    mismatches = sum(tuple(row) != rebuilt.get(row[0]) for row in clusters)
+    for index in (follower, rebuilt_index):
+        mismatches += sum(row != rebuilt.get(row[0]) for row in index_rows(index))
+    return mismatches
+
+
+def run_engine(engine_name: str, items: List[tuple], legacy_share: float, seed: int) -> tuple:
+    """
+    Replays the items with one reconcile engine on a fresh database: the
+    first half one request per transaction, the rest through
+    reconcile_batch. Some clusters are deleted after the first quarter to
+    exercise legacy groups. Returns (serialized responses, contact rows,
+    cluster rows, statements, seconds, identifier order mismatches).
+    """
+    main.settings = replace(main.settings, reconcile_engine=engine_name)
+    main.identity_index = follower = FollowerIndex()
+    follower.ready = True
+    Session = temp_sessionmaker()
+    counter = [0]
+    event.listen(Session.kw["bind"], "before_cursor_execute", lambda *args: counter.__setitem__(0, counter[0] + 1))
+    responses = []
+    elapsed = 0.0
+    rng = random.Random(seed)
+    with Session() as db:
+        half, quarter = len(items) // 2, len(items) // 4
+        for position, (email, phone_number) in enumerate(items[:half]):
+            if position == quarter:
+                primary_ids = db.scalars(select(IdentityCluster.primaryId)).all()
+                legacy = [i for i in primary_ids if rng.random() < legacy_share]
+                db.execute(delete(IdentityCluster).where(IdentityCluster.primaryId.in_(legacy)))
+                db.commit()
+            start = time.perf_counter()
+            response = main.reconcile_contact(db, email, phone_number)
+            db.commit()
+            elapsed += time.perf_counter() - start
+            responses.append(response.model_dump_json())
+        start = time.perf_counter()
+        batch = main.identify_batch(db, items[half:])
+        elapsed += time.perf_counter() - start
+        responses.extend(response.model_dump_json() for response in batch)
+        statements = counter[0]
+        contacts = db.execute(
+            select(Contact.id, Contact.email, Contact.phoneNumber, Contact.linkedId, Contact.linkPrecedence)
+            .order_by(Contact.id)
+        ).all()
+        clusters = db.execute(
+            select(IdentityCluster.primaryId, IdentityCluster.emails, IdentityCluster.phoneNumbers,
+                   IdentityCluster.secondaryContactIds)
+            .order_by(IdentityCluster.primaryId)
+        ).all()
+        main.identity_index = main.IdentityIndex()
+        mismatches = order_mismatches(db, clusters, follower)
+    return responses, contacts, clusters, statements, elapsed, mismatches
+
+
+def check_engines(requests: int, identifiers: int, seed: int) -> int:
+    """
+    Differential check of the reconcile engines: replays the same random
+    workload with the ORM and the Core engine and compares every serialized
+    response byte for byte, then the final contact and identity_cluster
+    tables. Each engine must also keep identifiers in creation order (see
+    order_mismatches). Prints the throughput of each engine and returns the
+    number of differences.
+    """
+    items = engine_workload(requests, identifiers, seed)
+    results = {name: run_engine(name, items, 0.3, seed) for name in main.RECONCILE_ENGINES}
+    orm, core = results["orm"], results["core"]
+
+    print_table(["engine", "req/s", "statements/req"], (
+        [name, f"{requests / result[4]:.0f}", f"{result[3] / requests:.2f}"] for name, result in results.items()
+    ))
+    failures = 0
+    for position, (expected, actual) in enumerate(zip(orm[0], core[0])):
+        if expected != actual:
+            failures += 1
+            if failures <= 5:
+                print(f"request {position} {items[position]}:\n  orm:  {expected}\n  core: {actual}")
+    for table, index in (("contact", 1), ("identity_cluster", 2)):
+        if orm[index] != core[index]:
+            failures += 1
+            print(f"{table} tables differ")
+    for name, result in results.items():
+        if result[5]:
+            failures += 1
+            print(f"{name}: {result[5]} groups out of creation order")
+    print(f"{len(orm[0])} responses compared, {failures} differences")
+    return failures
+
+
+def redundant_contacts(db) -> int:
+    """
+    Contacts carrying no identifier that an older contact of their group
+    lacks. A request only inserts a contact when it brings something new to
+    every group it matches (merging them first), so reconciling requests
+    one at a time never leaves one behind, whatever their order.
+    """
+    redundant = 0
+    current_id, seen = None, set()
+    rows = db.execute(
+        select(func.coalesce(Contact.linkedId, Contact.id), Contact.email, Contact.phoneNumber)
+        .order_by(func.coalesce(Contact.linkedId, Contact.id), Contact.id)
+    )
+    for primary_id, email, phone_number in rows:
+        if primary_id != current_id:
+            current_id, seen = primary_id, set()
+        keys = {key for key in (("email", email), ("phone", phone_number)) if key[1]}
+        redundant += keys <= seen
+        seen |= keys
+    return redundant
+
+
+def split_identifiers(db) -> int:
+    """
+    Identifiers carried by contacts of more than one group, which a merge
+    should have joined.
+    """
+    split = 0
+    for column in (Contact.email, Contact.phoneNumber):
+        split += len(db.execute(
+            select(column)
+            .where(column.is_not(None))
+            .group_by(column)
+            .having(func.count(func.distinct(func.coalesce(Contact.linkedId, Contact.id))) > 1)
+        ).all())
+    return split
+
+
+def check_concurrency(threads: int, requests: int, identifiers: int, seed: int) -> int:
+    """
+    Concurrent direct-mode writes: `threads` threads each send `requests`
+    random /identify requests through their own sessions, with each engine,
+    with and without the identity index answering lookups. Interleaved
+    requests must leave the same kind of state as sequential ones: no
+    failed request, no redundant contact, no identifier split across
+    groups, and clusters and index equal to a full rebuild. Returns the
+    number of failed checks.
+    """
+    def rows():
+        for engine_name in main.RECONCILE_ENGINES:
+            for indexed in (False, True):
+                main.settings = replace(main.settings, reconcile_engine=engine_name)
+                main.identity_index = index = main.IdentityIndex()
+                index.ready = indexed
+                Session = temp_sessionmaker()
+                errors = []
+
+                def client(number):
+                    for email, phone_number in engine_workload(requests, identifiers, seed + number):
+                        with Session() as db:
+                            try:
+                                main.identify(db, email, phone_number)
+                            except Exception as exc:
+                                errors.append(exc)
+
+                workers = [threading.Thread(target=client, args=(number,)) for number in range(threads)]
+                elapsed = timed(lambda: [worker.start() for worker in workers] + [worker.join() for worker in workers])
+                with Session() as db:
+                    contacts = db.scalar(select(func.count()).select_from(Contact))
+                    redundant, split = redundant_contacts(db), split_identifiers(db)
+                    clusters = db.execute(
+                        select(IdentityCluster.primaryId, IdentityCluster.emails, IdentityCluster.phoneNumbers,
+                               IdentityCluster.secondaryContactIds)
+                    ).all()
+                    main.identity_index = main.IdentityIndex()
+                    mismatches = order_mismatches(db, clusters, index)
+                failed = bool(errors or redundant or split or mismatches)
+                if errors:
+                    print(f"{engine_name}{' + index' if indexed else ''}: {type(errors[0]).__name__}: {errors[0]}")
+                yield [
+                    engine_name, "yes" if indexed else "no", f"{threads * requests / elapsed:.0f}", contacts,
+                    len(errors), redundant, split, mismatches, "FAIL" if failed else "ok",
+                ]
+
+    table = list(rows())
+    print_table(
+        ["engine", "index", "req/s", "contacts", "errors", "redundant", "split", "mismatches", "result"], table
+    )
+    return sum(row[-1] == "FAIL" for row in table)
+
+
+def check_singleflight(requests: int, pairs: int) -> int:
+    """
+    Identical concurrent /identify calls through the endpoint, in both
+    write modes: `requests` threads released together over `pairs`
+    distinct pairs, each a new email for a stored phone number, with every
+    statement slowed down so the calls overlap. Each pair must insert one
+    secondary, all callers of a pair must get the same bytes, and callers
+    must have been coalesced onto running calls. Also checks that waiters
+    receive the exception of the call they joined. Returns the number of
+    failed checks.
+    """
+    def slow_statement(*args):
+        time.sleep(0.005)
+
+    def rows():
+        for write_mode in ("direct", "serialized"):
+            if write_mode == "direct":
+                Session = ReadSession = temp_sessionmaker()
+                main.write_queue = None
+            else:
+                Session, ReadSession = serialized_sessionmakers("default", requests)
+                main.write_queue = main.WriteQueue(Session)
+                main.write_queue.start()
+            with Session() as db:
+                for pair in range(pairs):
+                    main.reconcile_contact(db, f"stored{pair}@example.com", f"flight{pair}")
+                db.commit()
+            main.identify_flights = flights = main.SingleFlight()
+            for bind in {Session.kw["bind"], ReadSession.kw["bind"]}:
+                event.listen(bind, "before_cursor_execute", slow_statement)
+            start = threading.Barrier(requests)
+            bodies = [None] * requests
+
+            def client(number):
+                request = IdentifyRequest(email=f"new{number % pairs}@example.com", phoneNumber=f"flight{number % pairs}")
+                start.wait()
+                with ReadSession() as db:
+                    bodies[number] = (number % pairs, main.identify_contact(request, db).body)
+
+            workers = [threading.Thread(target=client, args=(number,)) for number in range(requests)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            if main.write_queue is not None:
+                main.write_queue.stop()
+                main.write_queue = None
+            with Session() as db:
+                contacts = db.scalar(select(func.count()).select_from(Contact))
+            snapshot = flights.snapshot()
+            distinct = len(set(bodies))
+            failed = (
+                contacts != 2 * pairs or distinct != pairs or snapshot["coalesced"] == 0
+                or snapshot["calls"] + snapshot["coalesced"] != requests or snapshot["inFlight"]
+            )
+            yield [write_mode, requests, snapshot["calls"], snapshot["coalesced"], contacts, 2 * pairs, distinct,
+                   "FAIL" if failed else "ok"]
+
+        # Waiters get the exception of the call they joined
+        flights = main.SingleFlight()
+        release = threading.Event()
+        outcomes = []
+
+        def failing_call():
+            release.wait()
+            raise ValueError("boom")
+
+        def caller():
+            try:
+                flights.do("key", failing_call)
+            except ValueError as exc:
+                outcomes.append(str(exc))
+
+        callers = [threading.Thread(target=caller) for _ in range(requests)]
+        for thread in callers:
+            thread.start()
+        # Give up after a few seconds so a SingleFlight that never coalesces
+        # fails the check instead of hanging it
+        deadline = time.monotonic() + 5
+        while flights.snapshot()["coalesced"] < requests - 1 and time.monotonic() < deadline:
+            time.sleep(0.001)
+        release.set()
+        for thread in callers:
+            thread.join()
+        snapshot = flights.snapshot()
+        failed = outcomes != ["boom"] * requests or snapshot["calls"] != 1 or snapshot["inFlight"]
+        yield ["exception", requests, snapshot["calls"], snapshot["coalesced"], "-", "-", "-", "FAIL" if failed else "ok"]
+
+    table = list(rows())
+    print_table(
+        ["write mode", "requests", "calls", "coalesced", "contacts", "expected", "responses", "result"], table
+    )
+    return sum(row[-1] == "FAIL" for row in table)
+
+
+def check_plans() -> int:
+    """
+    Runs every identify scenario (new primary, lookup, new secondary, merge,
+    legacy group without a cluster row), captures the statements it emits and
+    checks with EXPLAIN QUERY PLAN that none of them scans a whole table or
+    index. Returns the number of offending statements.
+    """
+    Session = temp_sessionmaker()
+    bench_engine = Session.kw["bind"]
+    with Session() as db:
+        seed_cluster(db, "a", 50)
+        seed_cluster(db, "b", 50)
+        legacy_id = seed_cluster(db, "c", 50)
+        db.execute(delete(IdentityCluster).where(IdentityCluster.primaryId == legacy_id))
+        db.commit()
+
+    # Include the statements of the cache paths
+    main.response_cache = main.ResponseCache(1 << 20)
+    main.identifier_cache = main.IdentifierCache(10000, 60.0)
+    captured = []
+    event.listen(bench_engine, "before_cursor_execute",
+                 lambda conn, cursor, statement, parameters, context, executemany: captured.append((statement, parameters)))
+    for payload in (
+        {"email": "new@example.com", "phoneNumber": "new"},
+        {"email": "a-1@example.com"},
+        {"email": "a-fresh@example.com", "phoneNumber": "a-1"},
+        {"email": "a-2@example.com", "phoneNumber": "b-3"},
+        {"email": "c-4@example.com", "phoneNumber": "c-fresh"},
+    ):
+        with Session() as db:
+            main.identify_contact(IdentifyRequest(**payload), db)
+
+    failures = 0
+    with bench_engine.connect() as conn:
+        raw = conn.connection.dbapi_connection
+        for statement, parameters in dict.fromkeys((s, tuple(p)) for s, p in captured):
+            if statement.startswith("INSERT"):
+                continue
+            plan = [row[3] for row in raw.execute(f"EXPLAIN QUERY PLAN {statement}", parameters)]
+            scans = [step for step in plan if step.startswith("SCAN")]
+            failures += bool(scans)
+            print(f"{'FULL SCAN' if scans else 'ok':>9} | {' '.join(statement.split())}")
+            for step in plan:
+                print(f"{'':>9} |   {step}")
+    return failures
+
+
+# Most statements each scenario may run with direct writes. Serialized
+# writes add the read-only attempt made before handing over to the writer.
+STATEMENT_BUDGETS = {
+    "new primary": 5,
+    "repeat": 1,
+    "new secondary": 5,
+    "merge": 8,
+}
+
+
+def check_statements() -> int:
+    """
+    Runs every identify scenario (new primary, repeated pair, new secondary,
+    merge) with each reconcile engine and write mode, counting its statements
+    and the reads it issues after its first commit. A scenario fails when it
+    reads after committing, since the response must be built from what the
+    write already knew, or when it exceeds its statement budget. Returns the
+    number of failures.
+    """
+    scenarios = {
+        "new primary": ("new@example.com", "new"),
+        "repeat": ("a-1@example.com", "a-1"),
+        "new secondary": ("a-fresh@example.com", "a-1"),
+        "merge": ("a-2@example.com", "b-3"),
+    }
+
+    def rows():
+        for engine_name in main.RECONCILE_ENGINES:
+            main.settings = replace(main.settings, reconcile_engine=engine_name)
+            for write_mode in ("direct", "serialized"):
+                if write_mode == "direct":
+                    Session = ReadSession = temp_sessionmaker()
+                    writer = None
+                else:
+                    Session, ReadSession = serialized_sessionmakers("default", 1)
+                    writer = main.WriteQueue(Session)
+                    writer.start()
+                with Session() as db:
+                    seed_cluster(db, "a", 50)
+                    seed_cluster(db, "b", 50)
+
+                log = []
+                for bind in {Session.kw["bind"], ReadSession.kw["bind"]}:
+                    event.listen(bind, "before_cursor_execute",
+                                 lambda conn, cursor, statement, *args: log.append(statement.lstrip()[:6].upper()))
+                    event.listen(bind, "commit", lambda conn: log.append("COMMIT"))
+                for scenario, (email, phone_number) in scenarios.items():
+                    log.clear()
+                    with ReadSession() as db:
+                        main.identify(db, email, phone_number, writer)
+                    statements = [entry for entry in log if entry != "COMMIT"]
+                    committed = log.index("COMMIT") if "COMMIT" in log else len(log)
+                    reads = log[committed:].count("SELECT")
+                    budget = STATEMENT_BUDGETS[scenario] + (2 if writer is not None and scenario != "repeat" else 0)
+                    failed = reads > 0 or len(statements) > budget
+                    yield [engine_name, write_mode, scenario, len(statements), budget, reads, "FAIL" if failed else "ok"]
+                if writer is not None:
+                    writer.stop()
+
+    table = list(rows())
+    print_table(["engine", "write mode", "scenario", "statements", "budget", "reads after", "result"], table)
+    return sum(row[-1] == "FAIL" for row in table)
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    merge = sub.add_parser("merge", help="merge time versus group size")
+    merge.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 5000, 20000])
+
+    sub.add_parser("plans", help="check that no identify statement does a full scan")
+    sub.add_parser("statements", help="check identify statement counts and that nothing is read after the commit")
+
+    profiles = sub.add_parser("profiles", help="read/write throughput per SQLite storage profile")
+    profiles.add_argument("--profiles", nargs="+", default=list(main.STORAGE_PROFILES))
+    profiles.add_argument("--requests", type=int, default=1000)
+    profiles.add_argument("--readers", type=int, default=4)
+
+    writers = sub.add_parser("writers", help="direct versus serialized writes under concurrent clients")
+    writers.add_argument("--clients", type=int, default=50)
+    writers.add_argument("--requests", type=int, default=40)
+    writers.add_argument("--profile", default="default", choices=list(main.STORAGE_PROFILES))
+
+    batching = sub.add_parser("batching", help="serialized write throughput versus micro-batch window")
+    batching.add_argument("--windows", type=float, nargs="+", default=[0, 1, 2, 5, 10])
+    batching.add_argument("--clients", type=int, default=50)
+    batching.add_argument("--requests", type=int, default=40)
+    batching.add_argument("--max-batch", type=int, default=64)
+    batching.add_argument("--profile", default="default", choices=list(main.STORAGE_PROFILES))
+
+    bulk = sub.add_parser("bulk", help="identify/batch throughput versus batch size")
+    bulk.add_argument("--sizes", type=int, nargs="+", default=[1, 10, 100, 1000, 10000])
+
+    lookup = sub.add_parser("lookup", help="read-only lookup versus identify throughput")
+    lookup.add_argument("--requests", type=int, default=1000)
+
+    cache = sub.add_parser("cache", help="hot group throughput with and without the response cache")
+    cache.add_argument("--requests", type=int, default=5000)
+    cache.add_argument("--hot", type=int, default=100)
+    cache.add_argument("--bytes", type=int, default=1 << 20)
+    cache.add_argument("--identifiers", type=int, default=10000)
+
+    bloom = sub.add_parser("bloom", help="never-seen identifiers with and without the Bloom filter")
+    bloom.add_argument("--requests", type=int, default=2000)
+    bloom.add_argument("--seeded", type=int, default=20000)
+    bloom.add_argument("--capacity", type=int, default=100000)
+
+    fastpath = sub.add_parser("fastpath", help="share of /identify requests taking each path")
+    fastpath.add_argument("--requests", type=int, default=2000)
+    fastpath.add_argument("--repeat-share", type=float, default=0.7)
+
+    alloc = sub.add_parser("alloc", help="allocation per response versus cluster size")
+    alloc.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000])
+    alloc.add_argument("--requests", type=int, default=50)
+
+    etag = sub.add_parser("etag", help="resolve cost uncached, cached and revalidated with If-None-Match")
+    etag.add_argument("--sizes", type=int, nargs="+", default=[10, 1000, 10000])
+    etag.add_argument("--requests", type=int, default=200)
+
+    timestamps = sub.add_parser("timestamps", help="createdAt ties and insert cost in the configured TIMESTAMP_MODE")
+    timestamps.add_argument("--requests", type=int, default=2000)
+
+    engines = sub.add_parser("engines", help="differential check and throughput of the ORM and Core engines")
+    engines.add_argument("--requests", type=int, default=3000)
+    engines.add_argument("--identifiers", type=int, default=300)
+    engines.add_argument("--seed", type=int, default=1)
+
+    singleflight = sub.add_parser("singleflight", help="check that identical concurrent identify calls are coalesced")
+    singleflight.add_argument("--requests", type=int, default=30)
+    singleflight.add_argument("--pairs", type=int, default=3)
+
+    concurrency = sub.add_parser("concurrency", help="check concurrent direct-mode writes against sequential invariants")
+    concurrency.add_argument("--threads", type=int, default=16)
+    concurrency.add_argument("--requests", type=int, default=150)
+    concurrency.add_argument("--identifiers", type=int, default=80)
+    concurrency.add_argument("--seed", type=int, default=1)
+
+    latency = sub.add_parser("latency", help="sync versus async /identify latency under concurrent connections")
+    latency.add_argument("--connections", type=int, default=200)
+    latency.add_argument("--requests", type=int, default=4000)
+    latency.add_argument("--profile", default="wal", choices=list(main.STORAGE_PROFILES))
+    latency.add_argument("--write-mode", default="direct", choices=["direct", "serialized"])
+
+    args = parser.parse_args()
+    if args.command == "merge":
+        bench_merge(args.sizes)
+    elif args.command == "plans":
+        sys.exit(1 if check_plans() else 0)
+    elif args.command == "statements":
+        sys.exit(1 if check_statements() else 0)
+    elif args.command == "profiles":
+        bench_profiles(args.profiles, args.requests, args.readers)
+    elif args.command == "writers":
+        bench_writers(args.clients, args.requests, args.profile)
+    elif args.command == "batching":
+        sys.exit(1 if bench_batching(args.windows, args.clients, args.requests, args.profile, args.max_batch) else 0)
+    elif args.command == "bulk":
+        bench_bulk(args.sizes)
+    elif args.command == "lookup":
+        bench_lookup(args.requests)
+    elif args.command == "bloom":
+        bench_bloom(args.requests, args.seeded, args.capacity)
+    elif args.command == "fastpath":
+        bench_fastpath(args.requests, args.repeat_share)
+    elif args.command == "cache":
+        bench_cache(args.requests, args.hot, args.bytes, args.identifiers)
+    elif args.command == "alloc":
+        bench_alloc(args.sizes, args.requests)
+    elif args.command == "etag":
+        bench_etag(args.sizes, args.requests)
+    elif args.command == "timestamps":
+        bench_timestamps(args.requests)
+    elif args.command == "engines":
+        sys.exit(1 if check_engines(args.requests, args.identifiers, args.seed) else 0)
+    elif args.command == "singleflight":
+        sys.exit(1 if check_singleflight(args.requests, args.pairs) else 0)
+    elif args.command == "concurrency":
+        sys.exit(1 if check_concurrency(args.threads, args.requests, args.identifiers, args.seed) else 0)
+    elif args.command == "latency":
+        bench_latency(args.connections, args.requests, args.profile, args.write_mode)
+
+
+if __name__ == "__main__":
+    main_cli()
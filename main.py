@@ -1,12 +1,140 @@
 import uvicorn
-from fastapi import FastAPI, Depends, HTTPException, status
-from pydantic import BaseModel, EmailStr
-from typing import List, Optional, Set
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Enum, ForeignKey
+from fastapi import FastAPI, Body, Depends, Header, HTTPException, Query, Request, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import Response, StreamingResponse
+from starlette.requests import ClientDisconnect
+from pydantic import BaseModel, EmailStr, PrivateAttr, TypeAdapter, ValidationError
+from typing import Annotated, AsyncIterator, List, Optional, Tuple
+from sqlalchemy import create_engine, Column, Integer, String, Text, Float, DateTime, Enum, ForeignKey, JSON, Index, select, insert, update, delete, or_, event, text
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import sessionmaker, Session, DeclarativeBase, Mapped, mapped_column, relationship
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.sql import func
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool, StaticPool, NullPool, SingletonThreadPool
+from contextlib import asynccontextmanager
+from concurrent.futures import Future
+from collections import OrderedDict
+from dataclasses import dataclass, fields, replace
+import asyncio
 import enum
 import datetime
+import hashlib
+import json
+import math
+import os
+import queue
+import threading
+import time
+
+# --- Settings ---
+
+@dataclass(frozen=True)
+class Settings:
+    """
+    Runtime configuration. Values come from the JSON file named by the
+    CONFIG_FILE environment variable (keys are the field names), overridden
+    by environment variables named after the upper-cased field names, e.g.
+    DATABASE_URL or POOL_SIZE.
+    """
+    database_url: str = "sqlite:///./test.db"
+    sqlite_profile: str = "default"
+    identity_index: bool = False
+
+    # Connection pool
+    pool_class: str = "queue"  # queue | static | null | singleton
+    pool_size: int = 5
+    max_overflow: int = 10
+    pool_timeout: float = 30.0
+    pool_pre_ping: bool = False
+    pool_recycle: int = -1  # Seconds, -1 never recycles
+
+    # Per-statement timeout in milliseconds, 0 disables it
+    statement_timeout_ms: int = 0
+
+    # "direct": every request thread writes through its own session.
+    # "serialized": one writer thread owns all mutations, while requests read
+    # through read_database_url (by default a read-only view of database_url).
+    write_mode: str = "direct"
+    read_database_url: str = ""
+
+    # Serve /identify from an async endpoint on an async engine (aiosqlite
+    # for SQLite) instead of a threadpool thread per request. Reads go to
+    # the same URL as the sync read pool; writes are awaited on the writer
+    # thread in either write mode.
+    async_db: bool = False
+
+    # Group commit for the serialized writer: requests arriving within the
+    # window (up to max size) are reconciled in order in one transaction.
+    # A window of 0 commits every request on its own.
+    write_batch_window_ms: float = 0.0
+    write_batch_max_size: int = 64
+
+    # "orm" reconciles through Contact / IdentityCluster objects, "core" with
+    # SQLAlchemy Core statements and plain rows; responses are identical
+    reconcile_engine: str = "orm"
+
+    # "server": contact timestamps come from the database clock (whole
+    # seconds on SQLite) and inserts read them back. "client": this process
+    # stamps them from a strictly increasing microsecond clock.
+    timestamp_mode: str = "server"
+
+    # Requests reconciled per transaction by the bulk endpoints
+    bulk_chunk_size: int = 500
+    # Most requests one /identify/batch body may carry; larger ones get 422
+    bulk_max_items: int = 10000
+    # Longest accepted line of the NDJSON stream endpoint, in bytes
+    stream_max_line_bytes: int = 65536
+
+    # In-process cache of consolidated responses by primary id, bounded in
+    # bytes (0 disables it). Invalidated by this process's own commits, so
+    # like identity_index it requires a single writer process.
+    response_cache_bytes: int = 0
+
+    # In-process cache from email / phone number to the primary id of its
+    # group, with negative entries for identifiers known not to exist
+    # (0 entries disables it). Same single writer process rule.
+    identifier_cache_size: int = 0
+    identifier_cache_ttl_s: float = 60.0
+
+    # Bloom filter over stored emails / phone numbers letting never-seen
+    # identifiers skip the lookup (0 capacity disables it). Same single
+    # writer process rule.
+    bloom_filter_capacity: int = 0
+    bloom_filter_fp_rate: float = 0.01
+
+    # Stored responses of /identify requests sent with an Idempotency-Key
+    idempotency_ttl_s: float = 86400.0
+    idempotency_max_keys: int = 100000
+
+    @classmethod
+    def load(cls) -> "Settings":
+        values = {}
+        config_file = os.getenv("CONFIG_FILE")
+        if config_file:
+            with open(config_file) as f:
+                values.update(json.load(f))
+        for field in fields(cls):
+            raw = os.getenv(field.name.upper())
+            if raw is not None:
+                values[field.name] = raw
+        return cls(**{
+            field.name: _coerce_setting(field.type, values[field.name])
+            for field in fields(cls) if field.name in values
+        })
+
+
+def _coerce_setting(kind, value):
+    if kind in (bool, "bool") and isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes", "on")
+    for name, convert in (("int", int), ("float", float), ("str", str)):
+        if kind in (convert, name):
+            return convert(value)
+    return value
+
+
+settings = Settings.load()
+
 
 # # --- Database Setup (SQLite) ---
 
@@ -19,14 +147,391 @@ import datetime
 # # Use check_same_thread=False for SQLite.
 # engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
 
-DATABASE_URL = "sqlite:///./test.db"
-# Use check_same_thread=False only for SQLite.
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# SQLite storage profiles: PRAGMAs applied to every new connection.
+# "default" keeps SQLite's rollback journal with synchronous=FULL, where a
+# write blocks all readers and every commit fsyncs. WAL lets readers run
+# alongside the writer, and synchronous=NORMAL only fsyncs at checkpoints
+# (a power loss may drop the last commits but never corrupts the database).
+STORAGE_PROFILES = {
+    "default": {},
+    "wal": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "busy_timeout": 5000,
+    },
+    "performance": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "busy_timeout": 5000,
+        "mmap_size": 268435456,  # 256 MiB
+        "cache_size": -65536,    # 64 MiB (negative values are KiB)
+        "temp_store": "MEMORY",
+    },
+}
+
+
+def apply_storage_profile(bind, profile: str) -> None:
+    """
+    Registers a connect hook issuing the PRAGMAs of a storage profile on
+    every new SQLite connection of the engine.
+    """
+    if profile not in STORAGE_PROFILES:
+        raise ValueError(f"Unknown SQLite storage profile {profile!r}, expected one of {sorted(STORAGE_PROFILES)}")
+    pragmas = STORAGE_PROFILES[profile]
+    if bind.dialect.name != "sqlite" or not pragmas:
+        return
+
+    @event.listens_for(bind, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+
+POOL_CLASSES = {
+    "queue": QueuePool,
+    "static": StaticPool,
+    "null": NullPool,
+    "singleton": SingletonThreadPool,
+}
+
+
+class PoolMetrics:
+    """
+    Connection pool instrumentation, used to size gunicorn workers against
+    the pool: checkouts, connections currently checked out, time spent
+    waiting for a connection and checkouts that went into overflow.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.connects = 0
+        self.checkouts = 0
+        self.checked_out = 0
+        self.peak_checked_out = 0
+        self.overflow_checkouts = 0
+        self.timeouts = 0
+        self.total_wait_s = 0.0
+        self.max_wait_s = 0.0
+
+    def record_wait(self, waited: float, timed_out: bool) -> None:
+        with self._lock:
+            self.total_wait_s += waited
+            self.max_wait_s = max(self.max_wait_s, waited)
+            self.timeouts += timed_out
+
+    def snapshot(self, pool) -> dict:
+        with self._lock:
+            data = {
+                "pool": type(pool).__name__,
+                "status": pool.status(),
+                "connects": self.connects,
+                "checkouts": self.checkouts,
+                "checkedOut": self.checked_out,
+                "peakCheckedOut": self.peak_checked_out,
+                "overflowCheckouts": self.overflow_checkouts,
+                "timeouts": self.timeouts,
+                "avgWaitMs": 1000 * self.total_wait_s / self.checkouts if self.checkouts else 0.0,
+                "maxWaitMs": 1000 * self.max_wait_s,
+            }
+        if isinstance(pool, QueuePool):
+            data.update(size=pool.size(), overflow=max(pool.overflow(), 0))
+        return data
+
+
+def instrumented_pool_class(pool_class, metrics: PoolMetrics):
+    """
+    Subclasses a pool class to measure the time spent acquiring a connection,
+    including waits for a free one and timeouts.
+    """
+    class InstrumentedPool(pool_class):
+        def _do_get(self):
+            start = time.perf_counter()
+            try:
+                connection = super()._do_get()
+            except Exception:
+                metrics.record_wait(time.perf_counter() - start, timed_out=True)
+                raise
+            metrics.record_wait(time.perf_counter() - start, timed_out=False)
+            return connection
+
+    InstrumentedPool.__name__ = InstrumentedPool.__qualname__ = f"Instrumented{pool_class.__name__}"
+    return InstrumentedPool
+
+
+def instrument_pool(bind, metrics: PoolMetrics) -> None:
+    """
+    Feeds the pool events of the engine into the given metrics.
+    """
+    @event.listens_for(bind, "connect")
+    def _on_connect(dbapi_connection, connection_record):
+        with metrics._lock:
+            metrics.connects += 1
+
+    @event.listens_for(bind, "checkout")
+    def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+        with metrics._lock:
+            metrics.checkouts += 1
+            metrics.checked_out += 1
+            metrics.peak_checked_out = max(metrics.peak_checked_out, metrics.checked_out)
+            if isinstance(bind.pool, QueuePool) and bind.pool.overflow() > 0:
+                metrics.overflow_checkouts += 1
+
+    @event.listens_for(bind, "checkin")
+    def _on_checkin(dbapi_connection, connection_record):
+        with metrics._lock:
+            metrics.checked_out -= 1
+
+
+def apply_statement_timeout(bind, timeout_ms: int) -> None:
+    """
+    Aborts statements running longer than the timeout. PostgreSQL and MySQL
+    enforce it server side; SQLite has no such setting, so a progress
+    handler interrupts the statement once its deadline has passed.
+    """
+    if not timeout_ms:
+        return
+    dialect = bind.dialect.name
+    if dialect == "postgresql":
+        @event.listens_for(bind, "connect")
+        def _set_pg_timeout(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute(f"SET statement_timeout = {int(timeout_ms)}")
+            cursor.close()
+    elif dialect == "mysql":
+        @event.listens_for(bind, "connect")
+        def _set_mysql_timeout(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute(f"SET SESSION max_execution_time = {int(timeout_ms)}")
+            cursor.close()
+    elif dialect == "sqlite":
+        @event.listens_for(bind, "connect")
+        def _install_progress_handler(dbapi_connection, connection_record):
+            info = connection_record.info
+
+            def interrupt_when_late():
+                deadline = info.get("statement_deadline")
+                return deadline is not None and time.monotonic() > deadline
+
+            # Checked every 1000 virtual machine instructions
+            if bind.dialect.is_async:
+                # aiosqlite runs the connection in its own thread
+                dbapi_connection.run_async(lambda conn: conn.set_progress_handler(interrupt_when_late, 1000))
+            else:
+                dbapi_connection.set_progress_handler(interrupt_when_late, 1000)
+
+        @event.listens_for(bind, "before_cursor_execute")
+        def _start_deadline(conn, cursor, statement, parameters, context, executemany):
+            conn.info["statement_deadline"] = time.monotonic() + timeout_ms / 1000
+
+        @event.listens_for(bind, "after_cursor_execute")
+        def _clear_deadline(conn, cursor, statement, parameters, context, executemany):
+            conn.info.pop("statement_deadline", None)
+
+
+def apply_write_lock_release(bind) -> None:
+    """
+    Releases the named lock acquire_write_lock takes on MySQL. Named locks
+    belong to the connection rather than the transaction, so they are
+    released when the session hands the connection back to the pool, after
+    its commit or rollback. SQLite and PostgreSQL release their write locks
+    with the transaction on their own.
+    """
+    if bind.dialect.name != "mysql":
+        return
+
+    @event.listens_for(bind, "checkin")
+    def _release_write_lock(dbapi_connection, connection_record):
+        if dbapi_connection is not None:
+            cursor = dbapi_connection.cursor()
+            cursor.execute("DO RELEASE_ALL_LOCKS()")
+            cursor.close()
+
+
+# Makes a connection refuse writes for its whole life
+READ_ONLY_STATEMENTS = {
+    "sqlite": "PRAGMA query_only = ON",
+    "postgresql": "SET SESSION CHARACTERISTICS AS TRANSACTION READ ONLY",
+    "mysql": "SET SESSION TRANSACTION READ ONLY",
+}
+
+
+def apply_read_only(bind) -> None:
+    """
+    Registers a connect hook making every connection of the engine read-only,
+    whatever its URL points at: a mode=ro SQLite URL already refuses writes,
+    but an in-memory database or a read_database_url on a read-write role
+    would not.
+    """
+    statement = READ_ONLY_STATEMENTS.get(bind.dialect.name)
+    if statement is None:
+        return
+
+    @event.listens_for(bind, "connect")
+    def _set_read_only(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(statement)
+        cursor.close()
+
+
+def create_db_engine(config: Settings, metrics: Optional[PoolMetrics] = None, asynchronous: bool = False):
+    """
+    Creates the engine described by the settings: pool class and sizing,
+    SQLite storage profile, statement timeout and pool instrumentation.
+    With asynchronous=True, an AsyncEngine on the async driver of the same
+    database.
+    """
+    if config.pool_class not in POOL_CLASSES:
+        raise ValueError(f"Unknown pool class {config.pool_class!r}, expected one of {sorted(POOL_CLASSES)}")
+    pool_class = POOL_CLASSES[config.pool_class]
+    if asynchronous:
+        if pool_class is SingletonThreadPool:
+            raise ValueError("The singleton pool class cannot be used with async_db")
+        if pool_class is QueuePool:
+            pool_class = AsyncAdaptedQueuePool
+
+    kwargs = {
+        "poolclass": pool_class,
+        "pool_pre_ping": config.pool_pre_ping,
+        "pool_recycle": config.pool_recycle,
+    }
+    if issubclass(pool_class, QueuePool):
+        kwargs.update(
+            pool_size=config.pool_size,
+            max_overflow=config.max_overflow,
+            pool_timeout=config.pool_timeout,
+        )
+    if config.database_url.startswith("sqlite"):
+        # Use check_same_thread=False only for SQLite.
+        kwargs["connect_args"] = {"check_same_thread": False}
+    if metrics is not None:
+        kwargs["poolclass"] = instrumented_pool_class(pool_class, metrics)
+
+    if asynchronous:
+        bind = create_async_engine(async_url(config.database_url), **kwargs)
+        # Connection and pool events are registered on the underlying engine
+        events = bind.sync_engine
+    else:
+        bind = events = create_engine(config.database_url, **kwargs)
+    apply_storage_profile(events, config.sqlite_profile)
+    apply_statement_timeout(events, config.statement_timeout_ms)
+    apply_write_lock_release(events)
+    if metrics is not None:
+        instrument_pool(events, metrics)
+    return bind
+
+
+# Async driver used for each backend when async_db is enabled
+ASYNC_DRIVERS = {
+    "sqlite": "aiosqlite",
+    "postgresql": "asyncpg",
+    "mysql": "aiomysql",
+}
+
+
+def async_url(database_url: str) -> str:
+    """
+    Returns the URL of the same database through its async driver. URLs
+    that already name an async driver are returned unchanged.
+    """
+    url = make_url(database_url)
+    backend = url.get_backend_name()
+    if url.get_driver_name() in ASYNC_DRIVERS.values():
+        return database_url
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver known for {backend!r}, expected one of {sorted(ASYNC_DRIVERS)}")
+    return url.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}").render_as_string(hide_password=False)
+
+
+def read_only_url(database_url: str) -> str:
+    """
+    Returns a read-only variant of a SQLite URL (a URI filename with
+    mode=ro). Other backends are returned unchanged; point read_database_url
+    at a replica or a read-only role for them.
+    """
+    url = make_url(database_url)
+    if url.get_backend_name() != "sqlite" or url.database in (None, "", ":memory:"):
+        return database_url
+    return url.set(
+        database=f"file:{url.database}",
+        query={**url.query, "mode": "ro", "uri": "true"},
+    ).render_as_string(hide_password=False)
+
+
+class ContactSession(Session):
+    """
+    Session class of the application, carrying the commit hooks that keep
+    the in-memory structures in sync with the database.
+    """
+
+
+pool_metrics = PoolMetrics()
+engine = create_db_engine(settings, pool_metrics)
+# Objects are not expired on commit: responses are built before committing,
+# so expiring would only turn a later attribute access into a SELECT
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine, class_=ContactSession)
 
 class Base(DeclarativeBase):
     pass
 
+# --- Contact Timestamps ---
+
+TIMESTAMP_MODES = ("server", "client")
+
+if settings.timestamp_mode not in TIMESTAMP_MODES:
+    raise ValueError(f"Unknown timestamp mode {settings.timestamp_mode!r}, expected one of {TIMESTAMP_MODES}")
+
+
+class MonotonicClock:
+    """
+    UTC wall clock with microsecond resolution that never repeats or goes
+    back within the process: a reading not after the previous one (same
+    microsecond, or the clock was set back) becomes the previous one plus a
+    microsecond.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last: Optional[datetime.datetime] = None
+
+    def now(self) -> datetime.datetime:
+        with self._lock:
+            now = datetime.datetime.now(datetime.timezone.utc)
+            if self._last is not None and now <= self._last:
+                now = self._last + datetime.timedelta(microseconds=1)
+            self._last = now
+            return now
+
+
+contact_clock = MonotonicClock()
+
+
+def client_created_at(context) -> datetime.datetime:
+    return contact_clock.now()
+
+
+def client_updated_at(context) -> datetime.datetime:
+    # On insert the row is created and updated at the same instant
+    return context.get_current_parameters().get("createdAt") or contact_clock.now()
+
+
+def creation_order(created_at: datetime.datetime, contact_id: int) -> tuple:
+    """
+    Primary election key: the oldest contact wins and the lower id breaks
+    createdAt ties. SQLite returns timestamps without a timezone while those
+    stamped in process carry UTC, so both are compared as naive UTC.
+    """
+    if created_at.tzinfo is not None:
+        created_at = created_at.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return created_at, contact_id
+
+
+# The server defaults stay in the schema either way, so a database can
+# switch modes; the client mode adds Python-side defaults that take over
+client_timestamps = settings.timestamp_mode == "client"
+
+
 class LinkPrecedence(enum.Enum):
     primary = "primary"
     secondary = "secondary"
@@ -34,22 +539,25 @@ class LinkPrecedence(enum.Enum):
 class Contact(Base):
     __tablename__ = "contact"
 
-    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
-    phoneNumber: Mapped[Optional[str]] = mapped_column(String, nullable=True, index=True)
-    email: Mapped[Optional[EmailStr]] = mapped_column(String, nullable=True, index=True)
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    phoneNumber: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    email: Mapped[Optional[EmailStr]] = mapped_column(String, nullable=True)
     
     # Foreign key to link to the primary contact
-    linkedId: Mapped[Optional[int]] = mapped_column(Integer, ForeignKey("contact.id"), nullable=True)
+    linkedId: Mapped[Optional[int]] = mapped_column(Integer, ForeignKey("contact.id"), nullable=True, index=True)
     
     linkPrecedence: Mapped[LinkPrecedence] = mapped_column(
         Enum(LinkPrecedence), default=LinkPrecedence.primary
     )
     
     createdAt: Mapped[datetime.datetime] = mapped_column(
-        DateTime(timezone=True), server_default=func.now()
+        DateTime(timezone=True), server_default=func.now(),
+        default=client_created_at if client_timestamps else None,
     )
     updatedAt: Mapped[datetime.datetime] = mapped_column(
-        DateTime(timezone=True), onupdate=func.now(), server_default=func.now()
+        DateTime(timezone=True), server_default=func.now(),
+        default=client_updated_at if client_timestamps else None,
+        onupdate=client_created_at if client_timestamps else func.now(),
     )
     
     # Relationship to query linked contacts
@@ -57,18 +565,165 @@ class Contact(Base):
     secondary_contacts = relationship("Contact", back_populates="primary_contact", foreign_keys=[linkedId])
     primary_contact = relationship("Contact", back_populates="secondary_contacts", remote_side=[id], foreign_keys=[linkedId])
 
+    # --- Schema optimization profile ---
+    # The match lookups resolve an email / phone number straight to the
+    # primary id (coalesce(linkedId, id)), so the composite indexes cover
+    # them without touching the table. linkedId (indexed above) serves the
+    # secondary loads and merge re-links.
+    __table_args__ = (
+        Index("ix_contact_email_cluster", "email", "linkedId", "linkPrecedence", "createdAt"),
+        Index("ix_contact_phone_cluster", "phoneNumber", "linkedId", "linkPrecedence", "createdAt"),
+    )
+
+
+class ClusterFields:
+    """
+    Update rules of a materialized identity cluster, shared by the
+    IdentityCluster row and the Core engine's ClusterRecord so both build
+    identical clusters. Subclasses provide primaryId, emails, phoneNumbers
+    and secondaryContactIds.
+    """
+    __slots__ = ()
+
+    # JSON columns do not track in-place mutation, so every update below
+    # assigns a new list.
+
+    def add_identifiers(self, email: Optional[str], phone_number: Optional[str]) -> None:
+        if email and email not in self.emails:
+            self.emails = self.emails + [email]
+        if phone_number and phone_number not in self.phoneNumbers:
+            self.phoneNumbers = self.phoneNumbers + [phone_number]
+
+    def add_secondary(self, contact_id: int, email: Optional[str], phone_number: Optional[str]) -> None:
+        self.add_identifiers(email, phone_number)
+        self.secondaryContactIds = self.secondaryContactIds + [contact_id]
+
+    def assign_group(self, group: "IdentityGroup") -> None:
+        """
+        Replaces the identifiers and secondaries with those of a group read
+        from the contact rows, e.g. after a merge.
+        """
+        self.emails = list(group.emails)
+        self.phoneNumbers = list(group.phones)
+        self.secondaryContactIds = sorted(group.secondary_ids)
+
+    def to_response(self) -> "ContactResponseData":
+        return ContactResponseData(
+            primaryContatctId=self.primaryId,
+            emails=self.emails,
+            phoneNumbers=self.phoneNumbers,
+            secondaryContactIds=self.secondaryContactIds,
+        )
+
+
+class IdentityCluster(ClusterFields, Base):
+    """
+    Materialized view of one identity group, keyed by its primary contact id.
+
+    It holds the deduplicated emails and phone numbers (the primary's first)
+    and the secondary contact ids, and is maintained incrementally whenever a
+    contact is inserted or two groups are merged, so building a response is a
+    single primary-key read instead of loading every row of the group.
+    """
+    __tablename__ = "identity_cluster"
+
+    primaryId: Mapped[int] = mapped_column(Integer, ForeignKey("contact.id"), primary_key=True)
+    emails: Mapped[List[str]] = mapped_column(JSON, default=list)
+    phoneNumbers: Mapped[List[str]] = mapped_column(JSON, default=list)
+    secondaryContactIds: Mapped[List[int]] = mapped_column(JSON, default=list)
+
+
+class IdempotencyRecord(Base):
+    """
+    The stored response of an /identify request sent with an Idempotency-Key
+    header, replayed to retries of the same request until it expires.
+    """
+    __tablename__ = "idempotency_key"
+
+    key: Mapped[str] = mapped_column(String, primary_key=True)
+    # Hash of the request the key was first used with
+    fingerprint: Mapped[str] = mapped_column(String)
+    # ContactResponseData as compact JSON
+    response: Mapped[str] = mapped_column(Text)
+    # Unix time; also the eviction order
+    expiresAt: Mapped[float] = mapped_column(Float, index=True)
+
+
+# Single-column indexes replaced by the composite ones above, and the
+# partial index on primaries by age, which no statement used
+SUPERSEDED_INDEXES = ("ix_contact_id", "ix_contact_email", "ix_contact_phoneNumber", "ix_contact_primary_createdAt")
+
+
+def ensure_schema(bind) -> None:
+    """
+    Creates missing tables and indexes. create_all skips tables that already
+    exist, so indexes added to an existing table are created individually and
+    the superseded ones are dropped.
+    """
+    Base.metadata.create_all(bind=bind)
+    with bind.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+        for name in SUPERSEDED_INDEXES:
+            conn.execute(text(f'DROP INDEX IF EXISTS "{name}"'))
+
 
 # Create the database tables
-Base.metadata.create_all(bind=engine)
+ensure_schema(engine)
+
+# Read-only pool, serving the read-only endpoints in every write mode so they
+# never compete with writers for connections
+read_only_settings = replace(
+    settings, database_url=settings.read_database_url or read_only_url(settings.database_url)
+)
+read_only_engine = create_db_engine(read_only_settings)
+apply_read_only(read_only_engine)
+ReadOnlySessionLocal = sessionmaker(
+    autocommit=False, autoflush=False, expire_on_commit=False, bind=read_only_engine, class_=ContactSession
+)
 
-# Dependency to get a DB session
+# With serialized writes, request threads only read, through the read-only pool
+if settings.write_mode == "serialized":
+    read_settings, read_engine, ReadSessionLocal = read_only_settings, read_only_engine, ReadOnlySessionLocal
+elif settings.write_mode == "direct":
+    read_settings = settings
+    read_engine, ReadSessionLocal = engine, SessionLocal
+else:
+    raise ValueError(f"Unknown write mode {settings.write_mode!r}, expected 'direct' or 'serialized'")
+
+# The async engine serves /identify on the same database as the read pool.
+# Its sessions wrap a ContactSession, so the commit hooks apply unchanged.
+if settings.async_db:
+    async_engine = create_db_engine(read_settings, asynchronous=True)
+    AsyncSessionLocal = async_sessionmaker(
+        autoflush=False, expire_on_commit=False, bind=async_engine, class_=AsyncSession,
+        sync_session_class=ContactSession,
+    )
+else:
+    async_engine = AsyncSessionLocal = None
+
+# Dependency to get a DB session (read-only when writes are serialized)
 def get_db():
-    db = SessionLocal()
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+# Dependency of the read-only endpoints, in every write mode
+def get_read_only_db():
+    db = ReadOnlySessionLocal()
     try:
         yield db
     finally:
         db.close()
 
+# Async counterpart of get_db, on the async engine
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
 
 # --- Pydantic Models (API Request/Response) ---
 
@@ -82,175 +737,2339 @@ class ContactResponseData(BaseModel):
     phoneNumbers: List[str] # List of unique phone numbers, primary first
     secondaryContactIds: List[int] # List of secondary contact IDs
 
+    # The rendered /identify body and its ETag, filled by render_identify.
+    # Responses are not mutated once built, so the memo stays valid and a
+    # cached response is served without serializing it again.
+    _rendered: Optional[Tuple[bytes, str]] = PrivateAttr(default=None)
+
 class IdentifyResponse(BaseModel):
     contact: ContactResponseData
 
 
-# --- FastAPI Application ---
+identify_response_adapter = TypeAdapter(IdentifyResponse)
+identify_batch_response_adapter = TypeAdapter(List[IdentifyResponse])
 
-app = FastAPI(
-    title="Bitespeed Identity Reconciliation",
-    description="API for the Bitespeed backend assessment task.",
-)
 
-@app.post("/identify", response_model=IdentifyResponse)
-def identify_contact(
-    request: IdentifyRequest, db: Session = Depends(get_db)
-):
+def render_identify(data: ContactResponseData) -> Tuple[bytes, str]:
     """
-    Reconciles contact information by linking accounts based on
-    shared email addresses or phone numbers.
+    Returns the /identify JSON body of a response and its strong ETag,
+    rendering them at most once per response object. Identifiers are kept
+    in creation order everywhere, so one group state always renders the
+    same bytes and the ETag (a hash of them) is stable across requests,
+    processes and restarts.
     """
-    
-    email = request.email
-    phone_number = request.phoneNumber
+    rendered = data._rendered
+    if rendered is None:
+        body = identify_response_adapter.dump_json(IdentifyResponse.model_construct(contact=data))
+        rendered = data._rendered = (body, '"%s"' % hashlib.blake2b(body, digest_size=16).hexdigest())
+    return rendered
 
-    if not email and not phone_number:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Either email or phoneNumber must be provided.",
-        )
 
-    # 1. Find all contacts matching the provided email or phone number
-    matching_contacts = []
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Evaluates an If-None-Match header against an ETag: "*" or any listed
+    tag matches, compared weakly (a W/ prefix is ignored) as RFC 9110
+    requires for this header.
+    """
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*" or tag.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+# --- Identity Cluster Resolution ---
+
+def _match_conditions(email: Optional[str], phone_number: Optional[str]):
+    """
+    Builds the WHERE clause matching contacts by the provided identifiers.
+    A missing identifier is skipped rather than compared against NULL.
+    """
+    conditions = []
     if email:
-        matching_contacts.extend(db.query(Contact).filter(Contact.email == email).all())
+        conditions.append(Contact.email == email)
     if phone_number:
-        matching_contacts.extend(db.query(Contact).filter(Contact.phoneNumber == phone_number).all())
+        conditions.append(Contact.phoneNumber == phone_number)
+    return or_(*conditions)
 
-    # Get unique contacts (in case both email and phone matched the same contact)
-    unique_matching_contacts = list(dict.fromkeys(matching_contacts))
 
-    if not unique_matching_contacts:
-        # --- Scenario 1: No existing contacts found ---
-        # Create a new primary contact
-        new_contact = Contact(
-            email=email,
-            phoneNumber=phone_number,
-            linkPrecedence=LinkPrecedence.primary
+def load_matched_clusters(
+    db: Session, email: Optional[str], phone_number: Optional[str]
+) -> List[Tuple[Contact, Optional[IdentityCluster]]]:
+    """
+    Fetches the primary contact of every contact matching the given email /
+    phone number, together with its materialized identity cluster, in a
+    single SELECT.
+
+    A group is at most two levels deep (a primary and the secondaries whose
+    linkedId points at it), so the coalesced linkedId of each match is its
+    primary. The statement count stays constant regardless of group size.
+    The cluster is None for primaries written before clusters were
+    materialized.
+    """
+    matched_primary_ids = (
+        select(func.coalesce(Contact.linkedId, Contact.id))
+        .where(_match_conditions(email, phone_number))
+        .scalar_subquery()
+    )
+    stmt = (
+        select(Contact, IdentityCluster)
+        .outerjoin(IdentityCluster, IdentityCluster.primaryId == Contact.id)
+        .where(Contact.id.in_(matched_primary_ids))
+        .order_by(Contact.id)
+    )
+    return [tuple(row) for row in db.execute(stmt)]
+
+
+class ClusterRecord(ClusterFields):
+    """
+    An identity_cluster row (plus its primary's createdAt) as a compact plain
+    object, read with Core statements instead of as an IdentityCluster.
+
+    Records are built straight from result rows, with none of the identity
+    map and attribute tracking of an ORM instance, and to_response() builds
+    the response without validating (and copying) the lists again. `stored`
+    is False for primaries written before clusters were materialized, whose
+    record was built from their contact rows.
+    """
+    __slots__ = ("primaryId", "createdAt", "emails", "phoneNumbers", "secondaryContactIds", "stored")
+
+    def __init__(self, primary_id: int, created_at, emails: List[str], phone_numbers: List[str],
+                 secondary_ids: List[int], stored: bool = True):
+        self.primaryId = primary_id
+        self.createdAt = created_at
+        self.emails = emails
+        self.phoneNumbers = phone_numbers
+        self.secondaryContactIds = secondary_ids
+        self.stored = stored
+
+    # A record is never shared, so unlike an IdentityCluster row it is
+    # updated in place instead of copying its lists on every change
+
+    def add_identifiers(self, email: Optional[str], phone_number: Optional[str]) -> None:
+        if email and email not in self.emails:
+            self.emails.append(email)
+        if phone_number and phone_number not in self.phoneNumbers:
+            self.phoneNumbers.append(phone_number)
+
+    def add_secondary(self, contact_id: int, email: Optional[str], phone_number: Optional[str]) -> None:
+        self.add_identifiers(email, phone_number)
+        self.secondaryContactIds.append(contact_id)
+
+    def to_row(self) -> dict:
+        return {
+            "primaryId": self.primaryId,
+            "emails": self.emails,
+            "phoneNumbers": self.phoneNumbers,
+            "secondaryContactIds": self.secondaryContactIds,
+        }
+
+    def to_response(self) -> "ContactResponseData":
+        # Built from stored values, so validation (and the copy of every list
+        # it makes) is skipped
+        return ContactResponseData.model_construct(
+            primaryContatctId=self.primaryId,
+            emails=self.emails,
+            phoneNumbers=self.phoneNumbers,
+            secondaryContactIds=self.secondaryContactIds,
         )
-        db.add(new_contact)
-        db.commit()
-        db.refresh(new_contact)
-        
-        response_data = ContactResponseData(
-            primaryContatctId=new_contact.id,
-            emails=[email] if email else [],
-            phoneNumbers=[phone_number] if phone_number else [],
-            secondaryContactIds=[]
+
+
+def load_matched_records(db: Session, email: Optional[str], phone_number: Optional[str]) -> List[ClusterRecord]:
+    """
+    Core counterpart of load_matched_clusters: one SELECT of the matching
+    primaries' columns joined with their cluster rows, in id order. Clusters
+    missing for legacy primaries are built from their contact rows (but not
+    stored).
+    """
+    matched_primary_ids = (
+        select(func.coalesce(Contact.linkedId, Contact.id))
+        .where(_match_conditions(email, phone_number))
+        .scalar_subquery()
+    )
+    stmt = (
+        select(
+            Contact.id, Contact.email, Contact.phoneNumber, Contact.createdAt,
+            IdentityCluster.emails, IdentityCluster.phoneNumbers, IdentityCluster.secondaryContactIds,
         )
-        return IdentifyResponse(contact=response_data)
+        .outerjoin(IdentityCluster, IdentityCluster.primaryId == Contact.id)
+        .where(Contact.id.in_(matched_primary_ids))
+        .order_by(Contact.id)
+    )
+    records = []
+    for row in db.connection().execute(stmt).all():
+        if row.emails is None:
+            group = load_identity_group(db, row)
+            records.append(ClusterRecord(
+                row.id, row.createdAt, list(group.emails), list(group.phones), sorted(group.secondary_ids), stored=False
+            ))
+        else:
+            records.append(ClusterRecord(
+                row.id, row.createdAt, row.emails, row.phoneNumbers, row.secondaryContactIds
+            ))
+    return records
 
-    # --- Scenario 2 & 3: Existing contacts found ---
-    
-    # Find all unique primary contacts from the matched set
-    # A contact is primary if it has no linkedId
-    primary_contacts = sorted(
-        [c for c in unique_matching_contacts if c.linkPrecedence == LinkPrecedence.primary],
-        key=lambda c: c.createdAt
+
+def load_merged_group(db: Session, main_primary_id: int, primary_ids: List[int]) -> "IdentityGroup":
+    """
+    Builds the group formed by the given primaries and all of their
+    secondaries from their contact rows, as if merged under the main
+    primary. Identifiers keep creation order: the main primary's first,
+    then every other identifier in the order of the first contact carrying
+    it, the order incremental updates and rebuild_identity_clusters produce.
+    """
+    group = IdentityGroup()
+    rows = db.connection().execute(
+        select(Contact.id, Contact.email, Contact.phoneNumber)
+        .where(or_(Contact.id.in_(primary_ids), Contact.linkedId.in_(primary_ids)))
+        .order_by(Contact.id != main_primary_id, Contact.id)
     )
-    
-    # Also find any secondary contacts and trace them back to their primary
-    secondary_matches = [c for c in unique_matching_contacts if c.linkPrecedence == LinkPrecedence.secondary]
-    for sec_contact in secondary_matches:
-        if sec_contact.primary_contact and sec_contact.primary_contact not in primary_contacts:
-            primary_contacts.append(sec_contact.primary_contact)
-            
-    # Ensure primary contacts are unique and sorted by creation date
-    primary_contacts = sorted(
-        list(dict.fromkeys(primary_contacts)),
-        key=lambda c: c.createdAt
+    for contact_id, email, phone_number in rows:
+        group.add(email, phone_number)
+        if contact_id != main_primary_id:
+            group.secondary_ids.append(contact_id)
+    return group
+
+
+def load_identity_group(db: Session, primary: Contact) -> "IdentityGroup":
+    """
+    Builds the identity group of a primary from its contact rows, in
+    creation order (see load_merged_group).
+    """
+    group = IdentityGroup()
+    group.add(primary.email, primary.phoneNumber)
+    secondaries = db.execute(
+        select(Contact.id, Contact.email, Contact.phoneNumber)
+        .where(Contact.linkedId == primary.id)
+        .order_by(Contact.id)
     )
+    for contact_id, email, phone_number in secondaries:
+        group.add(email, phone_number)
+        group.secondary_ids.append(contact_id)
+    return group
 
-    # The "main" primary contact will be the oldest one
-    main_primary_contact = primary_contacts[0]
 
-    # --- Scenario 3: Multiple primary contacts found ---
-    # This means the request is linking two previously separate identities.
-    # We must merge them: pick the oldest as the main primary,
-    # and update the other(s) to be secondary.
-    
-    contacts_to_update = []
-    if len(primary_contacts) > 1:
-        for contact in primary_contacts[1:]:
-            # Demote this primary contact to secondary
-            contact.linkedId = main_primary_contact.id
-            contact.linkPrecedence = LinkPrecedence.secondary
-            contacts_to_update.append(contact)
-            
-            # Re-link all its children to the main primary contact
-            for child in contact.secondary_contacts:
-                child.linkedId = main_primary_contact.id
-                contacts_to_update.append(child)
-        
-        db.add_all(contacts_to_update)
+def materialize_identity_cluster(db: Session, primary: Contact) -> IdentityCluster:
+    """
+    Builds and adds the identity cluster of a primary from its contact rows.
+    """
+    cluster = load_identity_group(db, primary).to_cluster(primary.id)
+    db.add(cluster)
+    return cluster
 
-    # --- Check if new information is present ---
-    # Do we need to create a new secondary contact?
-    
-    # Gather all current info from the entire identity group
-    all_related_contacts = [main_primary_contact] + main_primary_contact.secondary_contacts + contacts_to_update
-    
-    existing_emails = {c.email for c in all_related_contacts if c.email}
-    existing_phones = {c.phoneNumber for c in all_related_contacts if c.phoneNumber}
 
-    # Check if the request contains new information
-    new_email = email and email not in existing_emails
-    new_phone = phone_number and phone_number not in existing_phones
+def merge_primaries(db: Session, main_cluster: IdentityCluster, demoted_clusters: List[IdentityCluster]) -> None:
+    """
+    Demotes the primaries of the given clusters to secondaries of the main
+    primary and re-links all of their children, using set-based UPDATE
+    statements no matter how many rows the merged groups contain. The
+    demoted clusters are deleted and the main one is re-read from the
+    merged contact rows (load_merged_group) rather than concatenated, so
+    its identifiers keep creation order.
 
-    if new_email or new_phone:
-        # Create a new secondary contact
-        new_secondary_contact = Contact(
-            email=email,
-            phoneNumber=phone_number,
-            linkedId=main_primary_contact.id,
-            linkPrecedence=LinkPrecedence.secondary
-        )
-        db.add(new_secondary_contact)
-        all_related_contacts.append(new_secondary_contact) # Add to list for response
-    
-    # Commit all changes (merges, new secondary contacts)
-    db.commit()
-    
-    # --- Construct the final response ---
-    
-    # We need to refresh the main primary contact to get all its updated secondary_contacts
-    db.refresh(main_primary_contact)
-    
-    # Gather all contacts in the consolidated group
-    final_group = [main_primary_contact] + main_primary_contact.secondary_contacts
-    
-    # Collect all unique emails and phone numbers
-    all_emails: Set[str] = set()
-    all_phones: Set[str] = set()
-    
-    for c in final_group:
-        if c.email:
-            all_emails.add(c.email)
-        if c.phoneNumber:
-            all_phones.add(c.phoneNumber)
-            
-    # Format emails: primary's email first, then the rest
-    ordered_emails = []
-    if main_primary_contact.email:
-        ordered_emails.append(main_primary_contact.email)
-    ordered_emails.extend([e for e in all_emails if e != main_primary_contact.email])
-
-    # Format phone numbers: primary's phone first, then the rest
-    ordered_phones = []
-    if main_primary_contact.phoneNumber:
-        ordered_phones.append(main_primary_contact.phoneNumber)
-    ordered_phones.extend([p for p in all_phones if p != main_primary_contact.phoneNumber])
-
-    # Get all secondary contact IDs
-    secondary_ids = [c.id for c in final_group if c.linkPrecedence == LinkPrecedence.secondary]
-    
-    response_data = ContactResponseData(
-        primaryContatctId=main_primary_contact.id,
-        emails=ordered_emails,
-        phoneNumbers=ordered_phones,
-        secondaryContactIds=sorted(list(set(secondary_ids))) # Ensure unique and sorted
+    Contacts loaded in the session are updated in Python to match
+    ("evaluate"), which costs no statement, so they stay correct without
+    being expired and reloaded after the commit.
+    """
+    main_primary_id = main_cluster.primaryId
+    demoted_ids = [c.primaryId for c in demoted_clusters]
+
+    # Re-link all children of the demoted primaries to the main primary contact
+    db.execute(
+        update(Contact)
+        .where(Contact.linkedId.in_(demoted_ids))
+        .values(linkedId=main_primary_id)
+        .execution_options(synchronize_session="evaluate")
     )
-    
-    return IdentifyResponse(contact=response_data)
+    # Demote the primaries themselves
+    db.execute(
+        update(Contact)
+        .where(Contact.id.in_(demoted_ids))
+        .values(linkedId=main_primary_id, linkPrecedence=LinkPrecedence.secondary)
+        .execution_options(synchronize_session="evaluate")
+    )
+
+    main_cluster.assign_group(load_merged_group(db, main_primary_id, [main_primary_id]))
+    for demoted in demoted_clusters:
+        db.expunge(demoted)
+    db.execute(
+        delete(IdentityCluster)
+        .where(IdentityCluster.primaryId.in_(demoted_ids))
+        .execution_options(synchronize_session=False)
+    )
+
+
+# --- In-Memory Identity Index ---
+
+# Opt-in (settings.identity_index): the index is only correct while this
+# process is the sole writer of the contact table (a single worker), since it
+# learns about changes from its own commits.
 
+class IdentityGroup:
+    """
+    The consolidated view of one identity group held by the index, with the
+    primary's identifiers first in each ordered collection.
+    """
+
+    __slots__ = ("emails", "phones", "secondary_ids")
+
+    def __init__(self):
+        self.emails: dict = {}  # Used as ordered sets
+        self.phones: dict = {}
+        self.secondary_ids: List[int] = []
+
+    def add(self, email: Optional[str], phone_number: Optional[str]) -> None:
+        if email:
+            self.emails.setdefault(email, None)
+        if phone_number:
+            self.phones.setdefault(phone_number, None)
+
+    def to_cluster_row(self, primary_id: int) -> dict:
+        return {
+            "primaryId": primary_id,
+            "emails": list(self.emails),
+            "phoneNumbers": list(self.phones),
+            "secondaryContactIds": sorted(self.secondary_ids),
+        }
+
+    def to_cluster(self, primary_id: int) -> IdentityCluster:
+        return IdentityCluster(**self.to_cluster_row(primary_id))
+
+    def to_response(self, primary_id: int) -> ContactResponseData:
+        # The lists are fresh copies of stored values, so validation (which
+        # would copy them again) is skipped
+        return ContactResponseData.model_construct(
+            primaryContatctId=primary_id,
+            emails=list(self.emails),
+            phoneNumbers=list(self.phones),
+            secondaryContactIds=sorted(self.secondary_ids),
+        )
+
+
+class IdentityIndex:
+    """
+    In-process index answering "which identity group does this email / phone
+    number belong to" without a database round trip.
+
+    Identifiers map to the id of a contact carrying them, and a union-find
+    over contact ids maps every contact to its primary. Roots are always the
+    primary contact of the group: the reconciliation logic decides which
+    primary is older, so unions are "by age" with the older root kept, and
+    finds compress paths so later lookups are a single hop.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.ready = False
+        # Commit tickets: committed changes are applied in commit order even
+        # when the transactions' after-commit hooks run out of order
+        self._next_ticket = 0
+        self._applied_ticket = 0
+        self._held: dict = {}  # ticket -> changes waiting for an earlier ticket
+        self._reset()
+
+    def _reset(self) -> None:
+        self.email_to_id: dict = {}
+        self.phone_to_id: dict = {}
+        self.parent: dict = {}
+        self.groups: dict = {}  # primary id -> IdentityGroup
+
+    def find(self, contact_id: int) -> int:
+        root = contact_id
+        while self.parent[root] != root:
+            root = self.parent[root]
+        # Path compression
+        while self.parent[contact_id] != root:
+            self.parent[contact_id], contact_id = root, self.parent[contact_id]
+        return root
+
+    def union(self, main_primary_id: int, other_id: int) -> None:
+        """
+        Merges the group of `other_id` into the group of `main_primary_id`,
+        which stays the root.
+        """
+        root, other_root = self.find(main_primary_id), self.find(other_id)
+        if root == other_root:
+            return
+        self.parent[other_root] = root
+        group, other = self.groups[root], self.groups.pop(other_root)
+        group.emails = self._creation_ordered(root, self.email_to_id, group.emails, other.emails)
+        group.phones = self._creation_ordered(root, self.phone_to_id, group.phones, other.phones)
+        group.secondary_ids.append(other_root)
+        group.secondary_ids.extend(other.secondary_ids)
+
+    @staticmethod
+    def _creation_ordered(root: int, first_ids: dict, *collections: dict) -> dict:
+        """
+        Merges identifier collections in the order load_merged_group reads
+        them: the root primary's identifiers first, then by the first
+        contact carrying each one.
+        """
+        values = [value for collection in collections for value in collection]
+        values.sort(key=lambda value: (first_ids[value] != root, first_ids[value]))
+        return dict.fromkeys(values)
+
+    def add_contact(self, contact_id: int, email: Optional[str], phone_number: Optional[str], linked_id: Optional[int]) -> None:
+        if linked_id is None:
+            self.parent[contact_id] = contact_id
+            self.groups[contact_id] = IdentityGroup()
+            root = contact_id
+        else:
+            self.parent[contact_id] = linked_id
+            root = self.find(linked_id)
+            self.groups[root].secondary_ids.append(contact_id)
+        self.groups[root].add(email, phone_number)
+        if email:
+            self.email_to_id.setdefault(email, contact_id)
+        if phone_number:
+            self.phone_to_id.setdefault(phone_number, contact_id)
+
+    def lookup(self, email: Optional[str], phone_number: Optional[str]) -> Optional[ContactResponseData]:
+        """
+        Returns the consolidated response when the request carries nothing new
+        and needs no merge: every provided identifier is known and they all
+        belong to the same group. Returns None when the database must be
+        involved.
+        """
+        with self._lock:
+            if not self.ready:
+                return None
+            roots = set()
+            for known, value in ((self.email_to_id, email), (self.phone_to_id, phone_number)):
+                if value:
+                    if value not in known:
+                        return None
+                    roots.add(self.find(known[value]))
+            if len(roots) != 1:
+                return None
+            root = roots.pop()
+            return self.groups[root].to_response(root)
+
+    def reserve(self) -> int:
+        """
+        Hands out the next commit ticket. Called before a transaction commits
+        while it still holds the write lock (see acquire_write_lock), so
+        tickets follow commit order.
+        """
+        with self._lock:
+            ticket = self._next_ticket
+            self._next_ticket += 1
+            return ticket
+
+    def apply(self, changes: list, ticket: int) -> None:
+        """
+        Applies the changes recorded by the transaction holding the ticket,
+        in order, once the changes of every earlier ticket are applied. A
+        transaction that did not commit applies no changes to free its
+        ticket.
+        """
+        with self._lock:
+            self._held[ticket] = changes
+            while self._applied_ticket in self._held:
+                for change in self._held.pop(self._applied_ticket):
+                    if self.ready:
+                        self._apply_change(change)
+                self._applied_ticket += 1
+
+    def _apply_change(self, change: tuple) -> None:
+        if change[0] == "merge":
+            _, main_primary_id, demoted_ids = change
+            for demoted_id in demoted_ids:
+                self.union(main_primary_id, demoted_id)
+        else:
+            _, contact_id, email, phone_number, linked_id = change
+            self.add_contact(contact_id, email, phone_number, linked_id)
+
+    def rebuild(self, db: Session) -> None:
+        """
+        Loads every contact, streaming primaries first so each group lists its
+        primary's identifiers ahead of the others.
+        """
+        with self._lock:
+            self.ready = False
+            self._reset()
+            columns = (Contact.id, Contact.email, Contact.phoneNumber, Contact.linkedId)
+            for condition in (Contact.linkedId.is_(None), Contact.linkedId.is_not(None)):
+                rows = db.execute(
+                    select(*columns).where(condition).order_by(Contact.id).execution_options(yield_per=10000)
+                )
+                for contact_id, email, phone_number, linked_id in rows:
+                    self.add_contact(contact_id, email, phone_number, linked_id)
+            self.ready = True
+
+identity_index = IdentityIndex()
+
+
+# --- Response and Identifier Caches ---
+
+# Both caches are opt-in and, like the identity index, learn about changes
+# from this process's own commits, so they require a single writer process.
+
+class ChangeClock:
+    """
+    Versions of the clusters (keyed by primary id) and identifiers (keyed by
+    ("email", value) / ("phone", value)) changed by committed transactions.
+
+    A reader takes now() before its first database read and the caches refuse
+    what it read if any of the keys changed in the meantime, so a reader
+    racing with a commit never caches a stale value. Versions of the least
+    recently changed keys are forgotten beyond a bound; their version becomes
+    the highest forgotten one, which can only refuse more, never accept a
+    stale value.
+    """
+
+    def __init__(self, max_keys: int = 100000):
+        self._lock = threading.Lock()
+        self.max_keys = max_keys
+        self._versions: OrderedDict = OrderedDict()
+        self._forgotten_version = 0
+        self._now = 0
+
+    def now(self) -> int:
+        with self._lock:
+            return self._now
+
+    def bump(self, keys) -> None:
+        with self._lock:
+            self._now += 1
+            for key in keys:
+                self._versions[key] = self._now
+                self._versions.move_to_end(key)
+            while len(self._versions) > self.max_keys:
+                _, self._forgotten_version = self._versions.popitem(last=False)
+
+    def changed_since(self, keys, version: int) -> bool:
+        with self._lock:
+            return any(self._versions.get(key, self._forgotten_version) > version for key in keys)
+
+
+def changed_cache_keys(changes: list) -> set:
+    """
+    Clusters and identifiers touched by the changes of a committed transaction
+    (see record_identity_change).
+    """
+    keys = set()
+    for change in changes:
+        if change[0] == "merge":
+            _, main_primary_id, demoted_ids = change
+            keys.add(main_primary_id)
+            keys.update(demoted_ids)
+        else:
+            _, contact_id, email, phone_number, linked_id = change
+            keys.add(linked_id or contact_id)
+            keys.update(identifier_keys(email, phone_number))
+    return keys
+
+
+def identifier_keys(email: Optional[str], phone_number: Optional[str]) -> List[tuple]:
+    return [(kind, value) for kind, value in (("email", email), ("phone", phone_number)) if value]
+
+
+cache_clock = ChangeClock()
+
+
+class ResponseCache:
+    """
+    LRU cache of consolidated responses keyed by primary contact id, bounded
+    by the approximate size of the cached responses, rendered bodies included,
+    in bytes. Entries are dropped when their cluster changes and refused when
+    it changed while they were being read (see ChangeClock).
+    """
+
+    ENTRY_OVERHEAD = 200  # Bytes per entry besides its strings and ids
+
+    def __init__(self, max_bytes: int, clock: ChangeClock = cache_clock):
+        self._lock = threading.Lock()
+        self.max_bytes = max_bytes
+        self.clock = clock
+        self._entries: OrderedDict = OrderedDict()  # primary id -> (response, size)
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    @classmethod
+    def entry_size(cls, response: ContactResponseData) -> int:
+        return (
+            cls.ENTRY_OVERHEAD
+            + sum(len(value) + 50 for value in response.emails)
+            + sum(len(value) + 50 for value in response.phoneNumbers)
+            + 36 * len(response.secondaryContactIds)
+            + len(render_identify(response)[0])
+        )
+
+    def get(self, primary_id: int) -> Optional[ContactResponseData]:
+        with self._lock:
+            entry = self._entries.get(primary_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(primary_id)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, response: ContactResponseData, read_version: int) -> None:
+        """
+        Caches a response read from the database by a reader that took
+        clock.now() before reading. The response is rendered here (see
+        render_identify), so hits are served as ready-made bytes.
+        """
+        if not self.enabled:
+            return
+        primary_id = response.primaryContatctId
+        size = self.entry_size(response)
+        if size > self.max_bytes or self.clock.changed_since([primary_id], read_version):
+            return
+        with self._lock:
+            previous = self._entries.pop(primary_id, None)
+            if previous is not None:
+                self.bytes -= previous[1]
+            self._entries[primary_id] = (response, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.bytes -= evicted_size
+                self.evictions += 1
+
+    def apply(self, changed_keys: set) -> None:
+        """
+        Drops the entries of the clusters changed by a committed transaction.
+        """
+        with self._lock:
+            for key in changed_keys:
+                entry = self._entries.pop(key, None) if isinstance(key, int) else None
+                if entry is not None:
+                    self.bytes -= entry[1]
+                    self.invalidations += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "maxBytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+class IdentifierCache:
+    """
+    LRU cache from identifier (("email", value) / ("phone", value)) to the
+    primary id of its group, with negative entries (primary id None) for
+    identifiers known not to exist. Entries expire after a TTL.
+
+    A committed insert drops the entries of its identifiers and a committed
+    merge drops every entry pointing at a demoted primary, through a reverse
+    map from primary id to identifiers. Identifiers a transaction is
+    inserting stay pending, in every session, until its changes are applied
+    or it rolls back: nothing is cached for them meanwhile, since a reader
+    may have read them as missing and the change clock only moves once the
+    commit is applied.
+    """
+
+    def __init__(self, max_entries: int, ttl_s: float, clock: ChangeClock = cache_clock):
+        self._lock = threading.Lock()
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.clock = clock
+        self._entries: OrderedDict = OrderedDict()  # identifier -> (primary id or None, expiry)
+        self._by_primary: dict = {}  # primary id -> identifiers pointing at it
+        self._pending: dict = {}  # identifier -> transactions inserting it
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def _pop(self, key) -> None:
+        primary_id, _ = self._entries.pop(key)
+        if primary_id is not None:
+            keys = self._by_primary[primary_id]
+            keys.discard(key)
+            if not keys:
+                del self._by_primary[primary_id]
+
+    def lookup(self, email: Optional[str], phone_number: Optional[str]) -> Optional[List[int]]:
+        """
+        Primary ids of the groups the provided identifiers belong to, when
+        every one of them is cached: an empty list means none of them
+        exists. Returns None when any of them is not cached.
+        """
+        if not self.enabled:
+            return None
+        now = time.monotonic()
+        primary_ids = []
+        with self._lock:
+            for key in identifier_keys(email, phone_number):
+                entry = self._entries.get(key)
+                if entry is not None and entry[1] <= now:
+                    self._pop(key)
+                    self.expirations += 1
+                    entry = None
+                if entry is None:
+                    self.misses += 1
+                    return None
+                self._entries.move_to_end(key)
+                if entry[0] is None:
+                    self.negative_hits += 1
+                else:
+                    self.hits += 1
+                    if entry[0] not in primary_ids:
+                        primary_ids.append(entry[0])
+        return primary_ids
+
+    def put(self, mapping: dict, read_version: int) -> None:
+        """
+        Caches identifier -> primary id (or None) pairs read from the database
+        by a reader that took clock.now() before reading.
+        """
+        if not self.enabled or not mapping:
+            return
+        keys = list(mapping) + [p for p in mapping.values() if p is not None]
+        if self.clock.changed_since(keys, read_version):
+            return
+        expiry = time.monotonic() + self.ttl_s
+        with self._lock:
+            for key, primary_id in mapping.items():
+                if key in self._pending:
+                    continue
+                if key in self._entries:
+                    self._pop(key)
+                self._entries[key] = (primary_id, expiry)
+                if primary_id is not None:
+                    self._by_primary.setdefault(primary_id, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._pop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def discard(self, keys) -> None:
+        """
+        Drops the entries of identifiers a transaction is inserting and marks
+        them pending until release(), so no session trusts or caches a
+        negative entry for them before the commit is applied.
+        """
+        with self._lock:
+            for key in keys:
+                if key in self._entries:
+                    self._pop(key)
+                self._pending[key] = self._pending.get(key, 0) + 1
+
+    def release(self, keys) -> None:
+        """
+        Ends the pending state discard() started, once the transaction's
+        changes are applied or it rolled back.
+        """
+        with self._lock:
+            for key in keys:
+                count = self._pending.pop(key, 0) - 1
+                if count > 0:
+                    self._pending[key] = count
+
+    def apply(self, changed_keys: set) -> None:
+        """
+        Drops the entries of the identifiers and demoted primaries changed by
+        a committed transaction.
+        """
+        with self._lock:
+            for key in changed_keys:
+                if isinstance(key, int):
+                    stale = self._by_primary.get(key, ())
+                else:
+                    stale = (key,) if key in self._entries else ()
+                for identifier in list(stale):
+                    self._pop(identifier)
+                    self.invalidations += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.negative_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "maxEntries": self.max_entries,
+                "ttlS": self.ttl_s,
+                "hits": self.hits,
+                "negativeHits": self.negative_hits,
+                "misses": self.misses,
+                "hitRate": (self.hits + self.negative_hits) / lookups if lookups else 0.0,
+                "expirations": self.expirations,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+response_cache = ResponseCache(settings.response_cache_bytes)
+identifier_cache = IdentifierCache(settings.identifier_cache_size, settings.identifier_cache_ttl_s)
+
+
+# --- Bloom Filter ---
+
+class IdentifierFilter:
+    """
+    Bloom filter over every stored email and phone number, so requests whose
+    identifiers were never seen skip the lookup and insert a new primary
+    directly. It answers "definitely absent" or "maybe present"; a false
+    positive only costs the lookup it would have run anyway.
+
+    Contacts are never deleted, so a plain Bloom filter is enough (no
+    cuckoo filter for deletes). Identifiers are added as soon as they are
+    inserted, before the commit: a rolled back insert leaves a stale bit,
+    which is again only a false positive. Like the caches it requires a
+    single writer process.
+
+    Until rebuild() has loaded the stored identifiers, every identifier is
+    "maybe present": an empty filter would otherwise call stored ones
+    absent and insert duplicate primaries.
+    """
+
+    def __init__(self, capacity: int, fp_rate: float):
+        self._lock = threading.Lock()
+        self.ready = False
+        self.fp_rate = fp_rate
+        self._size(capacity)
+        self.checks = 0
+        self.absent = 0
+        self.false_positives = 0
+
+    def _size(self, capacity: int) -> None:
+        self.capacity = capacity
+        self.num_bits = max(8, int(-capacity * math.log(self.fp_rate) / math.log(2) ** 2)) if capacity else 0
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2))) if capacity else 0
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.items = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.capacity > 0
+
+    def _positions(self, kind: str, value: str) -> List[int]:
+        digest = hashlib.blake2b(f"{kind}:{value}".encode(), digest_size=16).digest()
+        h1, h2 = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def _contains(self, kind: str, value: str) -> bool:
+        return all(self.bits[p >> 3] & (1 << (p & 7)) for p in self._positions(kind, value))
+
+    def add(self, email: Optional[str], phone_number: Optional[str]) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            for kind, value in identifier_keys(email, phone_number):
+                new = False
+                for p in self._positions(kind, value):
+                    new |= not self.bits[p >> 3] & (1 << (p & 7))
+                    self.bits[p >> 3] |= 1 << (p & 7)
+                self.items += new
+
+    def definitely_absent(self, email: Optional[str], phone_number: Optional[str], count: bool = True) -> bool:
+        """
+        Whether none of the provided identifiers is stored. `count` records
+        the check in the metrics; callers that check again later pass False.
+        """
+        if not self.enabled or not self.ready:
+            return False
+        absent = not any(self._contains(kind, value) for kind, value in identifier_keys(email, phone_number))
+        if count:
+            with self._lock:
+                self.checks += 1
+                self.absent += absent
+        return absent
+
+    def record_false_positive(self) -> None:
+        """
+        Called when a counted check said "maybe present" and the lookup (or
+        the identifier cache) found nothing. Checks made before the filter
+        was loaded said nothing, so they are not counted.
+        """
+        if not self.ready:
+            return
+        with self._lock:
+            self.false_positives += 1
+
+    def rebuild(self, db: Session) -> None:
+        """
+        Loads every stored identifier. The filter is sized for the configured
+        capacity, or for twice the identifiers already stored if that is more.
+        """
+        stored = db.execute(select(func.count(Contact.email) + func.count(Contact.phoneNumber))).scalar()
+        with self._lock:
+            self.ready = False
+            self._size(max(self.capacity, 2 * stored))
+        rows = db.execute(select(Contact.email, Contact.phoneNumber).execution_options(yield_per=10000))
+        for email, phone_number in rows:
+            self.add(email, phone_number)
+        self.ready = True
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            negatives = self.absent + self.false_positives
+            estimated = (1 - math.exp(-self.num_hashes * self.items / self.num_bits)) ** self.num_hashes if self.num_bits else 0.0
+            return {
+                "capacity": self.capacity,
+                "items": self.items,
+                "bits": self.num_bits,
+                "bytes": len(self.bits),
+                "hashes": self.num_hashes,
+                "estimatedFpRate": estimated,
+                "checks": self.checks,
+                "definitelyAbsent": self.absent,
+                "falsePositives": self.false_positives,
+                "observedFpRate": self.false_positives / negatives if negatives else 0.0,
+            }
+
+identifier_filter = IdentifierFilter(settings.bloom_filter_capacity, settings.bloom_filter_fp_rate)
+
+
+def record_identity_change(db: Session, change: tuple) -> None:
+    """
+    Queues a change for the in-memory index and caches, applied once the
+    session commits: ("contact", id, email, phoneNumber, linkedId) for an
+    inserted contact or ("merge", main_primary_id, demoted_ids) for a merge.
+    """
+    db.info.setdefault("identity_changes", []).append(change)
+    if change[0] == "contact":
+        _, _, email, phone_number, _ = change
+        identifier_filter.add(email, phone_number)
+        if identifier_cache.enabled:
+            pending = db.info.setdefault("pending_identifiers", set())
+            keys = [key for key in identifier_keys(email, phone_number) if key not in pending]
+            pending.update(keys)
+            identifier_cache.discard(keys)
+
+
+def inserted_in_transaction(db: Session, email: Optional[str], phone_number: Optional[str]) -> bool:
+    """
+    Whether the session's uncommitted transaction inserted one of the given
+    identifiers, which other readers may still cache as missing.
+    """
+    pending = db.info.get("pending_identifiers", ())
+    return any(key in pending for key in identifier_keys(email, phone_number))
+
+
+@event.listens_for(ContactSession, "before_commit")
+def _reserve_identity_ticket(session: Session) -> None:
+    # Still under the write lock taken by the write path
+    if session.info.get("identity_changes"):
+        session.info["identity_ticket"] = (identity_index, identity_index.reserve())
+
+
+@event.listens_for(ContactSession, "after_commit")
+def _apply_identity_changes(session: Session) -> None:
+    changes = session.info.pop("identity_changes", None)
+    reserved = session.info.pop("identity_ticket", None)
+    if reserved is not None:
+        index, ticket = reserved
+        index.apply(changes, ticket)
+    if changes:
+        if response_cache.enabled or identifier_cache.enabled:
+            changed_keys = changed_cache_keys(changes)
+            cache_clock.bump(changed_keys)
+            response_cache.apply(changed_keys)
+            identifier_cache.apply(changed_keys)
+
+
+@event.listens_for(ContactSession, "after_soft_rollback")
+def _discard_identity_changes(session: Session, previous_transaction) -> None:
+    session.info.pop("identity_changes", None)
+
+
+@event.listens_for(ContactSession, "after_transaction_end")
+def _release_identity_ticket(session: Session, transaction) -> None:
+    # Flushes run in subtransactions; only the session's own transaction ends
+    if transaction.parent is not None:
+        return
+    # A transaction that reserved a ticket but failed to commit frees it, or
+    # every later commit would wait for it
+    reserved = session.info.pop("identity_ticket", None)
+    if reserved is not None:
+        index, ticket = reserved
+        index.apply([], ticket)
+    # Runs after _apply_identity_changes on commit, once the change clock
+    # has moved, and on rollback or close
+    pending = session.info.pop("pending_identifiers", None)
+    if pending:
+        identifier_cache.release(pending)
+
+
+def rebuild_identity_clusters(db: Session, batch_size: int = 10000) -> None:
+    """
+    Recomputes the identity_cluster table from the contact table. Contacts
+    stream grouped by primary id, each primary ahead of its secondaries, so
+    memory holds one group and one insert batch at a time.
+    """
+    primary_id_column = func.coalesce(Contact.linkedId, Contact.id)
+    rows = db.execute(
+        select(primary_id_column, Contact.id, Contact.email, Contact.phoneNumber)
+        .order_by(primary_id_column, Contact.linkedId.is_not(None), Contact.id)
+        .execution_options(yield_per=batch_size)
+    )
+    db.execute(delete(IdentityCluster))
+
+    batch = []
+    current_id, group = None, None
+    for primary_id, contact_id, email, phone_number in rows:
+        if primary_id != current_id:
+            if group is not None:
+                batch.append(group.to_cluster_row(current_id))
+            if len(batch) >= batch_size:
+                db.execute(insert(IdentityCluster), batch)
+                batch = []
+            current_id, group = primary_id, IdentityGroup()
+        group.add(email, phone_number)
+        if contact_id != primary_id:
+            group.secondary_ids.append(contact_id)
+    if group is not None:
+        batch.append(group.to_cluster_row(current_id))
+    if batch:
+        db.execute(insert(IdentityCluster), batch)
+    db.commit()
+
+
+def identity_clusters_missing(db: Session) -> bool:
+    """
+    Checks whether any primary contact lacks its materialized cluster, e.g.
+    for a database created before the identity_cluster table existed.
+    """
+    orphan = db.execute(
+        select(Contact.id)
+        .outerjoin(IdentityCluster, IdentityCluster.primaryId == Contact.id)
+        .where(Contact.linkedId.is_(None), IdentityCluster.primaryId.is_(None))
+        .limit(1)
+    ).first()
+    return orphan is not None
+
+
+# --- Write Lock ---
+
+# Identity clusters are updated read-modify-write: a request reads the
+# clusters it matches, then rewrites them. Two transactions reading the same
+# cluster before either writes would lose one update, so the write path
+# takes a database-wide write lock before its first read. Reads outside the
+# write path (lookups, the exact-pair fast path) never take it.
+
+WRITE_LOCK_NAME = "bitespeed-identify"
+# PostgreSQL advisory locks are keyed by a 64-bit integer
+WRITE_LOCK_KEY = int.from_bytes(hashlib.blake2b(WRITE_LOCK_NAME.encode(), digest_size=8).digest(), "big", signed=True)
+
+
+def acquire_write_lock(db: Session) -> None:
+    """
+    Takes the write lock for the rest of the session's current transaction,
+    once per transaction.
+
+    SQLite starts the transaction with BEGIN IMMEDIATE, which takes the
+    database's RESERVED lock (waiting up to the busy timeout), because
+    pysqlite would otherwise only begin right before the first INSERT or
+    UPDATE, after the reads. When an earlier write of the transaction (say
+    an idempotency record stored by the same write batch) already made
+    pysqlite begin, that write holds the RESERVED lock and nothing more is
+    needed. PostgreSQL takes a transaction-scoped advisory
+    lock and MySQL a named lock released when the transaction ends (see
+    apply_write_lock_release).
+    """
+    conn = db.connection()  # Begins the session's transaction if needed
+    transaction = db.get_transaction()
+    if db.info.get("write_locked") is transaction:
+        return
+    dialect = conn.dialect.name
+    if dialect == "sqlite":
+        if not conn.connection.driver_connection.in_transaction:
+            conn.exec_driver_sql("BEGIN IMMEDIATE")
+    elif dialect == "postgresql":
+        conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": WRITE_LOCK_KEY})
+    elif dialect == "mysql":
+        acquired = conn.execute(
+            text("SELECT GET_LOCK(:name, :timeout)"), {"name": WRITE_LOCK_NAME, "timeout": settings.pool_timeout}
+        ).scalar()
+        if acquired != 1:
+            raise TimeoutError(f"Timed out waiting for the {WRITE_LOCK_NAME!r} write lock")
+    else:
+        raise ValueError(f"No write lock known for {dialect!r}, use write_mode 'serialized'")
+    db.info["write_locked"] = transaction
+
+
+# --- Reconciliation ---
+
+def find_unchanged_cluster(
+    matches: List[Tuple[Contact, Optional[IdentityCluster]]], email: Optional[str], phone_number: Optional[str]
+) -> Optional[IdentityCluster]:
+    """
+    Returns the identity cluster when a request needs no write: every match
+    belongs to the same primary, whose cluster already holds each provided
+    identifier. Returns None when reconciliation would change something.
+    """
+    if len(matches) != 1:
+        return None
+    _, cluster = matches[0]
+    if cluster is None or not getattr(cluster, "stored", True):
+        return None
+    if email and email not in cluster.emails:
+        return None
+    if phone_number and phone_number not in cluster.phoneNumbers:
+        return None
+    return cluster
+
+
+def resolve_contact(db: Session, email: Optional[str], phone_number: Optional[str]) -> Optional[ContactResponseData]:
+    """
+    Read-only counterpart of reconcile_contact: returns the consolidated
+    response if reconciling the request would not write anything, else None.
+    """
+    matches = [(None, record) for record in load_matched_records(db, email, phone_number)]
+    cluster = find_unchanged_cluster(matches, email, phone_number)
+    return cluster.to_response() if cluster is not None else None
+
+
+def match_primary_ids(db: Session, email: Optional[str], phone_number: Optional[str]) -> List[int]:
+    """
+    Primary ids of the contacts matching the given email / phone number, read
+    with one Core statement answered from the covering indexes.
+    """
+    stmt = (
+        select(func.coalesce(Contact.linkedId, Contact.id))
+        .where(_match_conditions(email, phone_number))
+        .distinct()
+    )
+    return db.connection().execute(stmt).scalars().all()
+
+
+def cached_primary_ids(
+    db: Session, email: Optional[str], phone_number: Optional[str], read_version: int
+) -> Optional[List[int]]:
+    """
+    Primary ids of the groups the given identifiers belong to, without
+    loading any ORM object: from the identifier cache when it knows every
+    provided identifier, else, when the response cache can use them, with
+    one Core statement answered from the covering indexes. An empty list
+    means none of the identifiers exists. Returns None when unknown.
+    """
+    primary_ids = identifier_cache.lookup(email, phone_number)
+    if primary_ids is None and response_cache.enabled:
+        primary_ids = match_primary_ids(db, email, phone_number)
+        keys = identifier_keys(email, phone_number)
+        # The statement does not tell which identifier matched which group,
+        # except when nothing matched or a single identifier was given
+        if not primary_ids:
+            identifier_cache.put(dict.fromkeys(keys), read_version)
+        elif len(keys) == 1:
+            identifier_cache.put({keys[0]: primary_ids[0]}, read_version)
+    return primary_ids
+
+
+def remember_identifiers(
+    response: Optional[ContactResponseData], email: Optional[str], phone_number: Optional[str], read_version: int
+) -> None:
+    """
+    Caches the identifiers of a request answered by a single group (or by
+    none): those in the response point at its primary, the others are known
+    not to exist.
+    """
+    if not identifier_cache.enabled:
+        return
+    mapping = {}
+    for kind, value in identifier_keys(email, phone_number):
+        known = response is not None and value in (response.emails if kind == "email" else response.phoneNumbers)
+        mapping[(kind, value)] = response.primaryContatctId if known else None
+    identifier_cache.put(mapping, read_version)
+
+
+def lookup_identity(db: Session, email: Optional[str], phone_number: Optional[str]) -> Optional[ContactResponseData]:
+    """
+    Returns the consolidated identity of the given identifiers without writing
+    anything, or None when none of them is known.
+
+    Identifiers that are not stored yet are ignored. When the identifiers
+    belong to several groups, the response is the merged view /identify
+    would return: the oldest primary first, the other primaries and all of
+    their secondaries as secondaries. Groups without a materialized cluster
+    are built from their contact rows but not stored.
+    """
+    indexed_response = identity_index.lookup(email, phone_number)
+    if indexed_response is not None:
+        return indexed_response
+
+    # Taken before the first read, so a commit racing with it keeps what
+    # was read out of the caches
+    if identifier_filter.definitely_absent(email, phone_number):
+        return None
+    read_version = cache_clock.now()
+    primary_ids = cached_primary_ids(db, email, phone_number, read_version)
+    if primary_ids == []:
+        if identifier_filter.enabled:
+            identifier_filter.record_false_positive()
+        return None
+    if primary_ids is not None and len(primary_ids) == 1 and response_cache.enabled:
+        response = response_cache.get(primary_ids[0])
+        if response is not None:
+            return response
+
+    records = load_matched_records(db, email, phone_number)
+    if not records:
+        if identifier_filter.enabled:
+            identifier_filter.record_false_positive()
+        remember_identifiers(None, email, phone_number, read_version)
+        return None
+    if len(records) == 1 and records[0].stored:
+        response = records[0].to_response()
+        response_cache.put(response, read_version)
+        remember_identifiers(response, email, phone_number, read_version)
+        return response
+
+    # Same election as reconcile_contact
+    records.sort(key=lambda record: creation_order(record.createdAt, record.primaryId))
+    # Read from the contact rows so the view has the identifier order the
+    # merge itself would store
+    main_primary_id = records[0].primaryId
+    view = load_merged_group(db, main_primary_id, [record.primaryId for record in records])
+    return view.to_response(main_primary_id)
+
+
+def create_primary_contact(db: Session, email: Optional[str], phone_number: Optional[str]) -> ContactResponseData:
+    """
+    Inserts a new primary contact with its identity cluster, for a request
+    none of whose identifiers exist yet.
+    """
+    if settings.reconcile_engine == "core":
+        return create_primary_contact_core(db, email, phone_number)
+    new_contact = Contact(
+        email=email,
+        phoneNumber=phone_number,
+        linkPrecedence=LinkPrecedence.primary
+    )
+    db.add(new_contact)
+    db.flush()
+    new_cluster = IdentityCluster(
+        primaryId=new_contact.id,
+        emails=[email] if email else [],
+        phoneNumbers=[phone_number] if phone_number else [],
+        secondaryContactIds=[]
+    )
+    db.add(new_cluster)
+    record_identity_change(db, ("contact", new_contact.id, email, phone_number, None))
+    db.flush()
+    return new_cluster.to_response()
+
+
+def reconcile_contact(db: Session, email: Optional[str], phone_number: Optional[str]) -> ContactResponseData:
+    """
+    Reconciles one request inside the session's current transaction and
+    returns the consolidated response. Changes are flushed but not
+    committed, so several reconciliations can share one transaction.
+    """
+    acquire_write_lock(db)
+    # Identifiers the Bloom filter or the cache know do not exist skip the
+    # lookup. The filter learns of inserts immediately; the cache is not
+    # trusted for identifiers this transaction inserted itself.
+    if identifier_filter.definitely_absent(email, phone_number):
+        return create_primary_contact(db, email, phone_number)
+    if identifier_cache.lookup(email, phone_number) == [] and not inserted_in_transaction(db, email, phone_number):
+        if identifier_filter.enabled:
+            identifier_filter.record_false_positive()
+        return create_primary_contact(db, email, phone_number)
+    if settings.reconcile_engine == "core":
+        return reconcile_matches_core(db, email, phone_number)
+
+    # 1. Resolve the primaries of all matching contacts together with their
+    # materialized identity clusters in one statement
+    matches = load_matched_clusters(db, email, phone_number)
+
+    if not matches:
+        if identifier_filter.enabled:
+            identifier_filter.record_false_positive()
+        # --- Scenario 1: No existing contacts found ---
+        return create_primary_contact(db, email, phone_number)
+
+    # --- Scenario 2 & 3: Existing contacts found ---
+    
+    # Primaries written before clusters were materialized get one now
+    clusters = {
+        primary.id: cluster or materialize_identity_cluster(db, primary)
+        for primary, cluster in matches
+    }
+
+    # Oldest first, the lower id first on createdAt ties
+    primary_contacts = sorted([primary for primary, _ in matches], key=lambda c: creation_order(c.createdAt, c.id))
+
+    # The "main" primary contact will be the oldest one
+    main_primary_contact = primary_contacts[0]
+    main_cluster = clusters[main_primary_contact.id]
+
+    # --- Scenario 3: Multiple primary contacts found ---
+    # This means the request is linking two previously separate identities.
+    # We must merge them: pick the oldest as the main primary,
+    # and update the other(s) to be secondary.
+    
+    if len(primary_contacts) > 1:
+        demoted_ids = [c.id for c in primary_contacts[1:]]
+        merge_primaries(db, main_cluster, [clusters[i] for i in demoted_ids])
+        record_identity_change(db, ("merge", main_primary_contact.id, demoted_ids))
+
+    # --- Check if new information is present ---
+    # Do we need to create a new secondary contact?
+    
+    # The (merged) cluster holds all current info from the entire identity group
+    new_email = email and email not in main_cluster.emails
+    new_phone = phone_number and phone_number not in main_cluster.phoneNumbers
+
+    if new_email or new_phone:
+        # Create a new secondary contact
+        new_secondary_contact = Contact(
+            email=email,
+            phoneNumber=phone_number,
+            linkedId=main_primary_contact.id,
+            linkPrecedence=LinkPrecedence.secondary
+        )
+        db.add(new_secondary_contact)
+        db.flush()
+        main_cluster.add_secondary(new_secondary_contact.id, email, phone_number)
+        record_identity_change(
+            db, ("contact", new_secondary_contact.id, email, phone_number, main_primary_contact.id)
+        )
+    
+    # --- Construct the final response ---
+
+    # The cluster already reflects the merges and the new secondary contact
+    db.flush()
+    return main_cluster.to_response()
+
+
+# --- Core Reconciliation Engine ---
+
+# settings.reconcile_engine = "core": the same reconciliation as the ORM path
+# above, statement for statement, but executed on the session's connection
+# with Core statements. Rows come back as plain tuples and clusters as
+# slotted ClusterRecords, so no identity map, attribute instrumentation or
+# unit-of-work flush is involved. Sharing the session's transaction keeps the
+# commit hooks (index, caches) working unchanged.
+
+RECONCILE_ENGINES = ("orm", "core")
+if settings.reconcile_engine not in RECONCILE_ENGINES:
+    raise ValueError(f"Unknown reconcile engine {settings.reconcile_engine!r}, expected one of {RECONCILE_ENGINES}")
+
+
+def insert_contact_core(
+    db: Session, email: Optional[str], phone_number: Optional[str], linked_id: Optional[int]
+) -> int:
+    """
+    Inserts one contact row and returns its id.
+    """
+    result = db.connection().execute(insert(Contact).values(
+        email=email,
+        phoneNumber=phone_number,
+        linkedId=linked_id,
+        linkPrecedence=LinkPrecedence.primary if linked_id is None else LinkPrecedence.secondary,
+    ))
+    return result.inserted_primary_key[0]
+
+
+def create_primary_contact_core(db: Session, email: Optional[str], phone_number: Optional[str]) -> ContactResponseData:
+    """
+    Core counterpart of create_primary_contact.
+    """
+    contact_id = insert_contact_core(db, email, phone_number, None)
+    record = ClusterRecord(contact_id, None, [email] if email else [], [phone_number] if phone_number else [], [])
+    db.connection().execute(insert(IdentityCluster).values(**record.to_row()))
+    record_identity_change(db, ("contact", contact_id, email, phone_number, None))
+    return record.to_response()
+
+
+def reconcile_matches_core(db: Session, email: Optional[str], phone_number: Optional[str]) -> ContactResponseData:
+    """
+    Core counterpart of the lookup, merge and insert steps of
+    reconcile_contact, once the shortcuts for unknown identifiers are done.
+    """
+    conn = db.connection()
+    records = load_matched_records(db, email, phone_number)
+    if not records:
+        if identifier_filter.enabled:
+            identifier_filter.record_false_positive()
+        return create_primary_contact_core(db, email, phone_number)
+
+    records.sort(key=lambda record: creation_order(record.createdAt, record.primaryId))
+    main_record = records[0]
+    changed = not main_record.stored
+
+    if len(records) > 1:
+        demoted_ids = [record.primaryId for record in records[1:]]
+        conn.execute(
+            update(Contact)
+            .where(Contact.linkedId.in_(demoted_ids))
+            .values(linkedId=main_record.primaryId)
+        )
+        conn.execute(
+            update(Contact)
+            .where(Contact.id.in_(demoted_ids))
+            .values(linkedId=main_record.primaryId, linkPrecedence=LinkPrecedence.secondary)
+        )
+        main_record.assign_group(load_merged_group(db, main_record.primaryId, [main_record.primaryId]))
+        conn.execute(delete(IdentityCluster).where(IdentityCluster.primaryId.in_(demoted_ids)))
+        record_identity_change(db, ("merge", main_record.primaryId, demoted_ids))
+        changed = True
+
+    new_email = email and email not in main_record.emails
+    new_phone = phone_number and phone_number not in main_record.phoneNumbers
+    if new_email or new_phone:
+        contact_id = insert_contact_core(db, email, phone_number, main_record.primaryId)
+        main_record.add_secondary(contact_id, email, phone_number)
+        record_identity_change(db, ("contact", contact_id, email, phone_number, main_record.primaryId))
+        changed = True
+
+    if not main_record.stored:
+        conn.execute(insert(IdentityCluster).values(**main_record.to_row()))
+    elif changed:
+        row = main_record.to_row()
+        del row["primaryId"]
+        conn.execute(update(IdentityCluster).where(IdentityCluster.primaryId == main_record.primaryId).values(**row))
+    return main_record.to_response()
+
+
+
+def exact_pair_response(db: Session, email: Optional[str], phone_number: Optional[str]) -> Optional[ContactResponseData]:
+    """
+    Fast path for requests repeating a stored contact. When one contact
+    already carries exactly the requested email and phone number (or the
+    single provided identifier), the request adds nothing and merges
+    nothing, so the answer is its group's cluster. One statement reads the
+    cluster row through the contact's index, without loading contacts and
+    without a write transaction. Returns None otherwise, or for groups
+    without a materialized cluster.
+    """
+    conditions = []
+    if email:
+        conditions.append(Contact.email == email)
+    if phone_number:
+        conditions.append(Contact.phoneNumber == phone_number)
+    matched_primary_id = (
+        select(func.coalesce(Contact.linkedId, Contact.id))
+        .where(*conditions)
+        .limit(1)
+        .scalar_subquery()
+    )
+    row = db.connection().execute(
+        select(
+            IdentityCluster.primaryId, IdentityCluster.emails, IdentityCluster.phoneNumbers,
+            IdentityCluster.secondaryContactIds,
+        )
+        .where(IdentityCluster.primaryId == matched_primary_id)
+    ).first()
+    if row is None:
+        return None
+    return ClusterRecord(row.primaryId, None, row.emails, row.phoneNumbers, row.secondaryContactIds).to_response()
+
+
+class IdentifyMetrics:
+    """
+    Counts how identify requests were answered: from the in-memory index,
+    the response cache, the exact-pair fast path, a read-only resolution, or
+    a reconciliation in a write transaction.
+    """
+
+    PATHS = ("index", "responseCache", "exactPair", "readOnly", "reconciled")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = dict.fromkeys(self.PATHS, 0)
+
+    def record(self, path: str) -> None:
+        with self._lock:
+            self.counts[path] += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            total = sum(self.counts.values())
+            return {
+                "requests": total,
+                "paths": dict(self.counts),
+                "percent": {path: 100 * count / total if total else 0.0 for path, count in self.counts.items()},
+            }
+
+identify_metrics = IdentifyMetrics()
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical calls: while a call for a key is running,
+    callers with the same key wait for it and receive its result (or its
+    exception) instead of running it again.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights: dict = {}  # key -> Future of the running call
+        self.calls = 0
+        self.coalesced = 0
+
+    def _join(self, key) -> Tuple[Future, bool]:
+        """
+        Returns the Future of the call for the key and whether the caller
+        leads it (runs it) rather than waits for it.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                self.coalesced += 1
+                return flight, False
+            flight = self._flights[key] = Future()
+            self.calls += 1
+            return flight, True
+
+    def _land(self, key) -> None:
+        with self._lock:
+            del self._flights[key]
+
+    def do(self, key, fn):
+        flight, leader = self._join(key)
+        if not leader:
+            return flight.result()
+        try:
+            flight.set_result(fn())
+        except BaseException as exc:
+            flight.set_exception(exc)
+        finally:
+            self._land(key)
+        return flight.result()
+
+    async def do_async(self, key, fn):
+        """
+        do() for a coroutine function: waiters await the running call
+        instead of blocking the event loop.
+        """
+        flight, leader = self._join(key)
+        if not leader:
+            return await asyncio.wrap_future(flight)
+        try:
+            flight.set_result(await fn())
+        except BaseException as exc:
+            flight.set_exception(exc)
+        finally:
+            self._land(key)
+        return flight.result()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"calls": self.calls, "coalesced": self.coalesced, "inFlight": len(self._flights)}
+
+identify_flights = SingleFlight()
+
+
+def carries_nothing_new(response: ContactResponseData, email: Optional[str], phone_number: Optional[str]) -> bool:
+    """
+    Whether every provided identifier is already part of the response's group.
+    """
+    return (not email or email in response.emails) and (not phone_number or phone_number in response.phoneNumbers)
+
+
+def identify(
+    db: Session, email: Optional[str], phone_number: Optional[str], writer: Optional["WriteQueue"] = None
+) -> ContactResponseData:
+    """
+    Answers an identify request, from the in-memory index when possible.
+    Without a writer, the request reconciles and commits in its own session.
+    With one, it first resolves read-only and only hands requests that need
+    a write to the writer thread, which re-resolves them in its transaction.
+    """
+    response, read_version = answer_identify(db, email, phone_number, writer is None)
+    if response is None:
+        # Hand the read connection back to the pool while waiting on the writer
+        db.rollback()
+        response = writer.submit(reconcile_contact, email, phone_number)
+        identify_metrics.record("reconciled")
+    cache_identify_response(response, email, phone_number, read_version)
+    return response
+
+
+async def identify_async(
+    db: AsyncSession, email: Optional[str], phone_number: Optional[str], writer: Optional["WriteQueue"] = None
+) -> ContactResponseData:
+    """
+    identify() on an async session: the same steps run through run_sync,
+    and the wait for the writer thread is awaited instead of blocking the
+    event loop.
+    """
+    response, read_version = await db.run_sync(answer_identify, email, phone_number, writer is None)
+    if response is None:
+        await db.rollback()
+        response = await asyncio.wrap_future(writer.enqueue(reconcile_contact, email, phone_number))
+        identify_metrics.record("reconciled")
+    cache_identify_response(response, email, phone_number, read_version)
+    return response
+
+
+def answer_identify(
+    db: Session, email: Optional[str], phone_number: Optional[str], can_write: bool
+) -> Tuple[Optional[ContactResponseData], Optional[int]]:
+    """
+    Everything identify does in the request's own session. Returns the
+    response, or None when the request needs the writer (only when
+    can_write is False), and the cache version taken before the first read
+    (None for answers from the in-memory index, which are not cached).
+    """
+    # Pure lookups and requests carrying nothing new are answered from the
+    # in-memory index when it is enabled
+    indexed_response = identity_index.lookup(email, phone_number)
+    if indexed_response is not None:
+        identify_metrics.record("index")
+        return indexed_response, None
+
+    # Hot groups are answered from the response cache when the request
+    # carries nothing new. The version is taken before the first read, so
+    # what a request racing with a commit read is not cached.
+    read_version = cache_clock.now()
+    if identifier_filter.definitely_absent(email, phone_number, count=False):
+        # Never seen: reconcile_contact inserts a new primary without a lookup
+        primary_ids = []
+    else:
+        primary_ids = cached_primary_ids(db, email, phone_number, read_version)
+    if primary_ids is not None and len(primary_ids) == 1 and response_cache.enabled:
+        response = response_cache.get(primary_ids[0])
+        if response is not None and carries_nothing_new(response, email, phone_number):
+            identify_metrics.record("responseCache")
+            return response, read_version
+
+    # Repeats of a stored contact are answered without a write transaction
+    # (identifiers known not to exist need a write anyway)
+    response = exact_pair_response(db, email, phone_number) if primary_ids != [] else None
+    if response is not None:
+        identify_metrics.record("exactPair")
+    elif can_write:
+        response = reconcile_contact(db, email, phone_number)
+        db.commit()
+        identify_metrics.record("reconciled")
+    else:
+        response = resolve_contact(db, email, phone_number) if primary_ids != [] else None
+        if response is not None:
+            identify_metrics.record("readOnly")
+    return response, read_version
+
+
+def cache_identify_response(
+    response: ContactResponseData, email: Optional[str], phone_number: Optional[str], read_version: Optional[int]
+) -> None:
+    if read_version is None:
+        return
+    # Refused for whatever this request's own commit changed
+    response_cache.put(response, read_version)
+    remember_identifiers(response, email, phone_number, read_version)
+
+
+def reconcile_batch(db: Session, items: List[Tuple[Optional[str], Optional[str]]]) -> List[ContactResponseData]:
+    """
+    Reconciles (email, phoneNumber) pairs in order inside the session's
+    current transaction, with the same result as reconciling them one by one.
+
+    One shared lookup finds which of the batch's identifiers already exist.
+    An item whose identifiers are neither stored nor used by an earlier item
+    of the batch is inserted as a new primary without its own lookup.
+    """
+    acquire_write_lock(db)
+    emails = {email for email, _ in items if email}
+    phones = {phone for _, phone in items if phone}
+    conditions = []
+    if emails:
+        conditions.append(Contact.email.in_(emails))
+    if phones:
+        conditions.append(Contact.phoneNumber.in_(phones))
+    known = set()
+    for email, phone_number in db.execute(select(Contact.email, Contact.phoneNumber).where(or_(*conditions))):
+        known.add(("email", email))
+        known.add(("phone", phone_number))
+
+    responses = []
+    for email, phone_number in items:
+        keys = {key for key in (("email", email), ("phone", phone_number)) if key[1]}
+        if keys & known:
+            responses.append(reconcile_contact(db, email, phone_number))
+        else:
+            responses.append(create_primary_contact(db, email, phone_number))
+        known |= keys
+    return responses
+
+
+def identify_batch(
+    db: Session, items: List[Tuple[Optional[str], Optional[str]]], writer: Optional["WriteQueue"] = None
+) -> List[ContactResponseData]:
+    """
+    Answers identify requests in order, one transaction per chunk of
+    settings.bulk_chunk_size items (run on the writer thread when writes are
+    serialized).
+    """
+    responses = []
+    for start in range(0, len(items), settings.bulk_chunk_size):
+        chunk = items[start:start + settings.bulk_chunk_size]
+        if writer is None:
+            responses.extend(reconcile_batch(db, chunk))
+            db.commit()
+        else:
+            responses.extend(writer.submit(reconcile_batch, chunk))
+    return responses
+
+
+# --- Write Serialization ---
+
+class WriteQueue:
+    """
+    Single writer thread owning every mutation. SQLite allows one writer at
+    a time, so funnelling writes through one thread and connection replaces
+    lock contention (and "database is locked" errors) between request
+    threads with an in-process queue.
+
+    With a batch window, the writer micro-batches: jobs arriving within the
+    window of the first one (up to max_batch jobs) run in arrival order in
+    one transaction with a single commit, then every caller gets its own
+    result. Running them in order in one session gives the same merges as
+    committing them one by one; if any job fails the batch is rolled back
+    and its jobs are replayed individually so only the failing one errors.
+
+    Once the writer thread exits, stopped or killed by a BaseException, the
+    jobs it will never run fail, and so does every job submitted later.
+    """
+
+    def __init__(self, session_factory: sessionmaker, batch_window_ms: float = 0.0, max_batch: int = 1):
+        self.session_factory = session_factory
+        self.batch_window = batch_window_ms / 1000
+        self.max_batch = max(1, max_batch) if batch_window_ms > 0 else 1
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._closed = False
+        self._running: list = []  # Jobs of the batch being run
+        self.batches = 0
+        self.jobs = 0
+        self.replays = 0  # Batches rolled back and replayed job by job
+
+    def start(self) -> None:
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="contact-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def submit(self, fn, *args):
+        """
+        Runs fn(session, *args) on the writer thread, commits, and returns its
+        result (or raises its exception) in the calling thread.
+        """
+        return self.enqueue(fn, *args).result()
+
+    def enqueue(self, fn, *args) -> Future:
+        """
+        Queues fn(session, *args) for the writer thread and returns the
+        Future of its result, for callers that wait without blocking.
+        """
+        future: Future = Future()
+        with self._lock:
+            if self._closed:
+                future.set_exception(RuntimeError("The contact writer thread has stopped"))
+            else:
+                self._queue.put((fn, args, future))
+        return future
+
+    def _collect(self, first) -> Tuple[list, bool]:
+        """
+        Gathers the batch started by `first`. Returns the jobs and whether
+        the stop sentinel was seen.
+        """
+        batch = [first]
+        deadline = time.monotonic() + self.batch_window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                job = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if job is None:
+                return batch, True
+            batch.append(job)
+        return batch, False
+
+    def _run_batch(self, batch: list) -> bool:
+        """
+        Runs the jobs in one transaction. Returns False, leaving every future
+        unresolved, if any job failed.
+        """
+        with self.session_factory() as db:
+            try:
+                results = [fn(db, *args) for fn, args, _ in batch]
+                db.commit()
+            except Exception:
+                db.rollback()
+                return False
+        for (_, _, future), result in zip(batch, results):
+            future.set_result(result)
+        return True
+
+    def _run(self) -> None:
+        try:
+            self._serve()
+        finally:
+            self._close()
+
+    def _close(self) -> None:
+        """
+        Refuses new jobs and fails the queued ones, and those of a batch cut
+        short by a BaseException, so no caller waits forever.
+        """
+        with self._lock:
+            self._closed = True
+        error = RuntimeError("The contact writer thread has stopped")
+        while True:
+            try:
+                job = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if job is not None and not job[2].done():
+                job[2].set_exception(error)
+        for _, _, future in self._running:
+            if not future.done():
+                future.set_exception(error)
+
+    def _serve(self) -> None:
+        stopping = False
+        while not stopping:
+            job = self._queue.get()
+            if job is None:
+                return
+            batch, stopping = self._collect(job)
+            self._running = batch
+            self.batches += 1
+            self.jobs += len(batch)
+            if len(batch) > 1:
+                if self._run_batch(batch):
+                    continue
+                self.replays += 1
+            for fn, args, future in batch:
+                with self.session_factory() as db:
+                    try:
+                        result = fn(db, *args)
+                        db.commit()
+                    except BaseException as exc:
+                        db.rollback()
+                        future.set_exception(exc)
+                    else:
+                        future.set_result(result)
+
+
+# The async endpoint always writes through the writer thread: with direct
+# writes, every in-flight request would open its own write transaction and
+# queue on SQLite's busy timeout, which under load expires ("database is
+# locked"). Reads stay on the request's own session.
+write_queue = (
+    WriteQueue(SessionLocal, settings.write_batch_window_ms, settings.write_batch_max_size)
+    if settings.write_mode == "serialized" or settings.async_db else None
+)
+
+
+# --- NDJSON Streaming ---
+
+async def ndjson_lines(chunks: AsyncIterator[bytes], max_line_bytes: int) -> AsyncIterator[Optional[bytes]]:
+    """
+    Splits a byte stream into lines as it arrives, holding at most one
+    partial line in memory. A line longer than max_line_bytes is dropped
+    and yielded as None, so the caller can report it without buffering it.
+    """
+    buffer = b""
+    oversized = False  # Dropping the rest of an over-long line
+    async for chunk in chunks:
+        buffer += chunk
+        # Scan from an offset and cut the consumed lines off once per chunk;
+        # slicing the remainder per line would copy it once per line
+        start = 0
+        while True:
+            newline = buffer.find(b"\n", start)
+            if newline < 0:
+                break
+            line, start = buffer[start:newline], newline + 1
+            if oversized:
+                oversized = False
+            else:
+                yield line if len(line) <= max_line_bytes else None
+        buffer = buffer[start:]
+        if oversized:
+            buffer = b""
+        elif len(buffer) > max_line_bytes:
+            yield None
+            buffer = b""
+            oversized = True
+    if buffer and not oversized:
+        yield buffer if len(buffer) <= max_line_bytes else None
+
+
+def parse_ndjson_request(line: bytes) -> Tuple[Optional[IdentifyRequest], Optional[str]]:
+    """
+    Parses one NDJSON line into a request, or returns the error to report.
+    """
+    try:
+        request = IdentifyRequest.model_validate_json(line)
+    except ValidationError as exc:
+        return None, "; ".join(f"{'.'.join(map(str, e['loc'])) or 'line'}: {e['msg']}" for e in exc.errors())
+    if not request.email and not request.phoneNumber:
+        return None, "Either email or phoneNumber must be provided."
+    return request, None
+
+
+class DuplexStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse for a body generator that itself reads the request
+    body. Under ASGI spec versions before 2.4, Starlette listens for client
+    disconnects by calling receive(), which would swallow the request body
+    messages the generator is waiting for; here the generator is the only
+    reader, and a disconnect surfaces through request.stream() instead.
+    """
+
+    async def __call__(self, scope, receive, send) -> None:
+        # Like StreamingResponse, report a send to a closed connection as a
+        # client disconnect rather than a server error
+        try:
+            await self.stream_response(send)
+        except OSError:
+            raise ClientDisconnect()
+        if self.background is not None:
+            await self.background()
+
+
+def _identify_stream_chunk(items: List[Tuple[Optional[str], Optional[str]]]) -> List[ContactResponseData]:
+    with ReadSessionLocal() as db:
+        return identify_batch(db, items, write_queue)
+
+
+async def identify_ndjson_stream(lines: AsyncIterator[Optional[bytes]]) -> AsyncIterator[bytes]:
+    """
+    Reconciles NDJSON request lines in chunks of settings.bulk_chunk_size and
+    yields one NDJSON line per input line, in input order: an IdentifyResponse,
+    or {"line": n, "error": ...} for a line that could not be parsed. Blank
+    lines are skipped. Memory is bounded by one chunk, whatever the upload
+    size.
+    """
+    pending: list = []  # (line number, request or None, error or None)
+
+    async def flush() -> AsyncIterator[bytes]:
+        items = [(r.email, r.phoneNumber) for _, r, _ in pending if r is not None]
+        responses = iter(await run_in_threadpool(_identify_stream_chunk, items) if items else [])
+        for line_number, request, error in pending:
+            if request is None:
+                yield json.dumps({"line": line_number, "error": error}).encode() + b"\n"
+            else:
+                yield IdentifyResponse(contact=next(responses)).model_dump_json().encode() + b"\n"
+        pending.clear()
+
+    line_number = 0
+    async for line in lines:
+        line_number += 1
+        if line is None:
+            request, error = None, f"Line exceeds {settings.stream_max_line_bytes} bytes."
+        elif not line.strip():
+            continue
+        else:
+            request, error = parse_ndjson_request(line)
+        pending.append((line_number, request, error))
+        if len(pending) >= settings.bulk_chunk_size:
+            async for output in flush():
+                yield output
+    if pending:
+        async for output in flush():
+            yield output
+
+
+# --- Idempotency Keys ---
+
+class IdempotencyStore:
+    """
+    Persists the response of each /identify request sent with an
+    Idempotency-Key header, so retries replay it from the idempotency_key
+    table without touching the contact table. Records expire after a TTL;
+    every PURGE_EVERY stores, expired records and the records beyond the
+    newest max_keys are deleted.
+    """
+
+    PURGE_EVERY = 100
+    MAX_KEY_LENGTH = 255
+
+    def __init__(self, ttl_s: float, max_keys: int):
+        self._lock = threading.Lock()
+        self.ttl_s = ttl_s
+        self.max_keys = max_keys
+        self.replays = 0
+        self.conflicts = 0
+        self.stores = 0
+        self.purges = 0
+
+    @staticmethod
+    def fingerprint(email: Optional[str], phone_number: Optional[str]) -> str:
+        payload = json.dumps([email or None, phone_number or None], separators=(",", ":"))
+        return hashlib.blake2b(payload.encode(), digest_size=16).hexdigest()
+
+    def lookup(self, db: Session, key: str, fingerprint: str) -> Optional[ContactResponseData]:
+        """
+        Returns the stored response of an unexpired key. Raises ValueError when
+        the key was used with a different request.
+        """
+        record = db.execute(
+            select(IdempotencyRecord.fingerprint, IdempotencyRecord.response)
+            .where(IdempotencyRecord.key == key, IdempotencyRecord.expiresAt > time.time())
+        ).first()
+        if record is None:
+            return None
+        if record.fingerprint != fingerprint:
+            with self._lock:
+                self.conflicts += 1
+            raise ValueError("Idempotency-Key was already used with a different request.")
+        with self._lock:
+            self.replays += 1
+        return ContactResponseData.model_validate_json(record.response)
+
+    def store(self, db: Session, key: str, fingerprint: str, data: ContactResponseData) -> None:
+        """
+        Adds a record inside the session's transaction, purging stale records
+        every PURGE_EVERY stores. Callers commit.
+        """
+        # An expired record with the same key is replaced. An unexpired one
+        # is kept, so a concurrent request with the same key fails on the
+        # primary key instead of overwriting the first client's response.
+        db.execute(
+            delete(IdempotencyRecord)
+            .where(IdempotencyRecord.key == key, IdempotencyRecord.expiresAt <= time.time())
+        )
+        db.add(IdempotencyRecord(
+            key=key,
+            fingerprint=fingerprint,
+            response=data.model_dump_json(),
+            expiresAt=time.time() + self.ttl_s,
+        ))
+        db.flush()
+        with self._lock:
+            self.stores += 1
+            purge = self.stores % self.PURGE_EVERY == 0
+        if purge:
+            self.purge(db)
+
+    def save(
+        self, db: Session, key: str, fingerprint: str, data: ContactResponseData, writer: Optional["WriteQueue"] = None
+    ) -> ContactResponseData:
+        """
+        Stores a response and commits, through the writer thread when writes
+        are serialized, and returns the response to send. When a concurrent
+        request stored a response for the key first, this request is answered
+        like a retry of it: with the stored response, or ValueError when it
+        was a different request.
+        """
+        try:
+            if writer is None:
+                self.store(db, key, fingerprint, data)
+                db.commit()
+            else:
+                writer.submit(self.store, key, fingerprint, data)
+        except IntegrityError:
+            if writer is None:
+                db.rollback()
+            return self.lookup(db, key, fingerprint) or data
+        return data
+
+    async def save_async(
+        self, db: AsyncSession, key: str, fingerprint: str, data: ContactResponseData, writer: Optional["WriteQueue"] = None
+    ) -> ContactResponseData:
+        """
+        save() on an async session, awaiting the writer thread.
+        """
+        try:
+            if writer is None:
+                await db.run_sync(self.store, key, fingerprint, data)
+                await db.commit()
+            else:
+                await asyncio.wrap_future(writer.enqueue(self.store, key, fingerprint, data))
+        except IntegrityError:
+            if writer is None:
+                await db.rollback()
+            return await db.run_sync(self.lookup, key, fingerprint) or data
+        return data
+
+    def purge(self, db: Session) -> None:
+        db.execute(delete(IdempotencyRecord).where(IdempotencyRecord.expiresAt <= time.time()))
+        cutoff = db.scalar(
+            select(IdempotencyRecord.expiresAt)
+            .order_by(IdempotencyRecord.expiresAt.desc())
+            .offset(self.max_keys)
+            .limit(1)
+        )
+        if cutoff is not None:
+            db.execute(delete(IdempotencyRecord).where(IdempotencyRecord.expiresAt <= cutoff))
+        with self._lock:
+            self.purges += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"replays": self.replays, "conflicts": self.conflicts, "stores": self.stores, "purges": self.purges}
+
+idempotency_store = IdempotencyStore(settings.idempotency_ttl_s, settings.idempotency_max_keys)
+
+
+# --- FastAPI Application ---
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    with SessionLocal() as db:
+        if identity_clusters_missing(db):
+            rebuild_identity_clusters(db)
+        if settings.identity_index:
+            identity_index.rebuild(db)
+        if identifier_filter.enabled:
+            identifier_filter.rebuild(db)
+    if write_queue is not None:
+        write_queue.start()
+    yield
+    if write_queue is not None:
+        write_queue.stop()
+    if async_engine is not None:
+        await async_engine.dispose()
+
+
+app = FastAPI(
+    title="Bitespeed Identity Reconciliation",
+    description="API for the Bitespeed backend assessment task.",
+    lifespan=lifespan,
+)
+
+def check_identify_request(request: IdentifyRequest, idempotency_key: Optional[str]) -> Optional[str]:
+    """
+    Validates an /identify request and its Idempotency-Key header. Returns
+    the request fingerprint when a key was sent.
+    """
+    if not request.email and not request.phoneNumber:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Either email or phoneNumber must be provided.",
+        )
+    if idempotency_key is None:
+        return None
+    if not idempotency_key or len(idempotency_key) > IdempotencyStore.MAX_KEY_LENGTH:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Idempotency-Key must be 1 to {IdempotencyStore.MAX_KEY_LENGTH} characters.",
+        )
+    return IdempotencyStore.fingerprint(request.email, request.phoneNumber)
+
+
+def identify_json_response(data: ContactResponseData) -> Response:
+    """
+    Renders an identify response body once, straight from the model, with
+    its ETag. Going through response_model would convert it to plain
+    objects, validate it again and then JSON-encode it; the route still
+    declares response_model for the OpenAPI schema.
+    """
+    body, etag = render_identify(data)
+    return Response(body, media_type="application/json", headers={"ETag": etag})
+
+
+def replay_identify(db: Session, idempotency_key: str, fingerprint: str) -> Optional[ContactResponseData]:
+    """
+    The stored response of an Idempotency-Key, or 422 if the key was used
+    with a different request.
+    """
+    try:
+        return idempotency_store.lookup(db, idempotency_key, fingerprint)
+    except ValueError as exc:
+        raise idempotency_conflict(exc)
+
+
+def idempotency_conflict(exc: ValueError) -> HTTPException:
+    return HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_CONTENT, detail=str(exc))
+
+
+def identify_contact(
+    request: IdentifyRequest,
+    db: Session = Depends(get_db),
+    idempotency_key: Annotated[Optional[str], Header(alias="Idempotency-Key")] = None,
+):
+    """
+    Reconciles contact information by linking accounts based on
+    shared email addresses or phone numbers.
+
+    With an Idempotency-Key header, the first response is stored and
+    retries with the same key and body replay it.
+    """
+    
+    email = request.email
+    phone_number = request.phoneNumber
+
+    fingerprint = check_identify_request(request, idempotency_key)
+    if fingerprint is not None:
+        stored = replay_identify(db, idempotency_key, fingerprint)
+        if stored is not None:
+            return identify_json_response(stored)
+
+    # Identical concurrent requests (client retries, fan-out) share one
+    # reconciliation instead of racing to insert the same secondary
+    key = (email or None, phone_number or None)
+    data = identify_flights.do(key, lambda: identify(db, email, phone_number, write_queue))
+
+    if fingerprint is not None:
+        try:
+            data = idempotency_store.save(db, idempotency_key, fingerprint, data, write_queue)
+        except ValueError as exc:
+            raise idempotency_conflict(exc)
+    return identify_json_response(data)
+
+
+async def identify_contact_async(
+    request: IdentifyRequest,
+    db: AsyncSession = Depends(get_async_db),
+    idempotency_key: Annotated[Optional[str], Header(alias="Idempotency-Key")] = None,
+):
+    """
+    Reconciles contact information by linking accounts based on
+    shared email addresses or phone numbers.
+
+    With an Idempotency-Key header, the first response is stored and
+    retries with the same key and body replay it.
+    """
+    email = request.email
+    phone_number = request.phoneNumber
+
+    fingerprint = check_identify_request(request, idempotency_key)
+    if fingerprint is not None:
+        stored = await db.run_sync(replay_identify, idempotency_key, fingerprint)
+        if stored is not None:
+            return identify_json_response(stored)
+
+    key = (email or None, phone_number or None)
+    data = await identify_flights.do_async(key, lambda: identify_async(db, email, phone_number, write_queue))
+
+    if fingerprint is not None:
+        try:
+            data = await idempotency_store.save_async(db, idempotency_key, fingerprint, data, write_queue)
+        except ValueError as exc:
+            raise idempotency_conflict(exc)
+    return identify_json_response(data)
+
+
+# The sync endpoint holds a threadpool thread for the whole request; the
+# async one (async_db) only awaits the database
+app.add_api_route(
+    "/identify",
+    identify_contact_async if settings.async_db else identify_contact,
+    methods=["POST"],
+    response_model=IdentifyResponse,
+)
+
+
+@app.post("/identify/batch", response_model=List[IdentifyResponse])
+def identify_contacts_batch(
+    requests: Annotated[List[IdentifyRequest], Body(max_length=settings.bulk_max_items)],
+    db: Session = Depends(get_db),
+):
+    """
+    Bulk variant of /identify: reconciles the requests in order, with the
+    same result as sending them one by one, and returns one response per
+    request. Bodies of more than settings.bulk_max_items requests get 422,
+    so one call cannot keep the writer busy for an arbitrary time.
+    """
+    for position, request in enumerate(requests):
+        if not request.email and not request.phoneNumber:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Item {position}: either email or phoneNumber must be provided.",
+            )
+
+    items = [(request.email, request.phoneNumber) for request in requests]
+    responses = [IdentifyResponse.model_construct(contact=data) for data in identify_batch(db, items, write_queue)]
+    return Response(identify_batch_response_adapter.dump_json(responses), media_type="application/json")
+
+
+@app.get("/contacts/resolve", response_model=IdentifyResponse)
+def resolve_contacts(
+    request: Annotated[IdentifyRequest, Query()],
+    db: Session = Depends(get_read_only_db),
+    if_none_match: Annotated[Optional[str], Header(alias="If-None-Match")] = None,
+):
+    """
+    Read-only lookup of the consolidated identity of an email and/or phone
+    number. Unlike /identify it never inserts or merges contacts, so it runs
+    on the read-only pool in every write mode and never waits on a writer.
+
+    Responses carry a strong ETag; a request whose If-None-Match lists the
+    current one gets an empty 304 instead of the body.
+    """
+    if not request.email and not request.phoneNumber:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Either email or phoneNumber must be provided.",
+        )
+
+    data = lookup_identity(db, request.email, request.phoneNumber)
+    if data is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="No contact matches the given email or phoneNumber.",
+        )
+    body, etag = render_identify(data)
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    return identify_json_response(data)
+
+
+@app.post("/identify/stream")
+async def identify_contacts_stream(request: Request):
+    """
+    Streaming bulk ingest: the body is newline-delimited /identify request
+    bodies (application/x-ndjson), reconciled in order in bounded-memory
+    chunks. Responses stream back as NDJSON, one line per input line, as
+    each chunk completes.
+    """
+    lines = ndjson_lines(request.stream(), settings.stream_max_line_bytes)
+    return DuplexStreamingResponse(identify_ndjson_stream(lines), media_type="application/x-ndjson")
+
+
+@app.get("/metrics/cache")
+def get_cache_metrics():
+    """
+    Size, hit/miss rate, evictions and invalidations of the response and
+    identifier caches, and memory and false-positive rate of the Bloom
+    filter.
+    """
+    return {
+        "responses": response_cache.snapshot(),
+        "identifiers": identifier_cache.snapshot(),
+        "bloomFilter": identifier_filter.snapshot(),
+    }
+
+
+@app.get("/metrics/identify")
+def get_identify_metrics():
+    """
+    How /identify requests were answered, as counts and percentages per path
+    (index, response cache, exact-pair fast path, read-only, reconciled), and
+    how many concurrent duplicates were coalesced into a running call and
+    how many retries were replayed from their Idempotency-Key.
+    """
+    return {
+        **identify_metrics.snapshot(),
+        "singleFlight": identify_flights.snapshot(),
+        "idempotency": idempotency_store.snapshot(),
+    }
+
+
+@app.get("/metrics/pool")
+def get_pool_metrics():
+    """
+    Connection pool instrumentation (checked-out connections, acquisition
+    wait times, overflow checkouts), for sizing workers against the pool.
+    """
+    return pool_metrics.snapshot(engine.pool)
@@ -0,0 +1,257 @@
+"""
+Offline re-clustering of the contact table.
+
+Rebuilds every linkedId / linkPrecedence assignment from scratch: contacts
+sharing an email or phone number (transitively) form one identity group, the
+oldest contact (createdAt, then id) becomes its primary and every other
+contact links to it directly. The identity_cluster table is rebuilt
+afterwards.
+
+Existing links are kept as grouping evidence by default: a request carrying
+the email of one group and the phone number of another merges the two groups
+without inserting a contact, so that bridge survives only as a linkedId.
+Pass --ignore-links to regroup from the stored identifiers alone, e.g. after
+links were corrupted.
+
+Uses the same settings as the app (DATABASE_URL, CONFIG_FILE, ...). Stop the
+service while it runs, and restart it afterwards so in-memory indexes are
+rebuilt.
+
+How it scales: contacts are read in streaming chunks. A process pool
+union-finds each chunk locally and spills (identifier, local root) pairs into
+buckets on disk, chosen by a hash of the identifier. The main process merges
+the chunks with a global union-find over arrays indexed by contact id, one
+bucket at a time, comparing the identifiers themselves, so memory is a few
+arrays of 8 bytes per contact plus one bucket of identifiers.
+
+Usage:
+    python recluster.py [--chunk-size 200000] [--workers N] [--buckets 64] [--ignore-links] [--dry-run]
+"""
+import argparse
+import hashlib
+import os
+import pickle
+import tempfile
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timezone
+from typing import List, Optional, Tuple
+
+from sqlalchemy import bindparam, func, select, update
+
+import main
+from main import Contact, LinkPrecedence
+
+NULL_ID = 0  # Contact ids start at 1
+
+
+# --- Union-find over contact ids ---
+
+def find(parent: array, node: int) -> int:
+    while parent[node] != node:
+        # Path halving
+        parent[node] = parent[parent[node]]
+        node = parent[node]
+    return node
+
+
+def union(parent: array, a: int, b: int) -> None:
+    root_a, root_b = find(parent, a), find(parent, b)
+    if root_a != root_b:
+        # Keep the lower id as root; the primary is elected separately
+        if root_a < root_b:
+            parent[root_b] = root_a
+        else:
+            parent[root_a] = root_b
+
+
+def created_seconds(created_at) -> float:
+    """
+    createdAt as seconds since the epoch, normalized like
+    main.creation_order: naive values (SQLite) are UTC, not local time, so
+    the election matches the app's even across DST transitions.
+    """
+    created_at, _ = main.creation_order(created_at, NULL_ID)
+    return created_at.replace(tzinfo=timezone.utc).timestamp()
+
+
+def identifier_bucket(identifier: str, buckets: int) -> int:
+    # Stable across worker processes, unlike hash(). Only spreads identifiers
+    # over buckets: a collision shares a bucket, it never merges groups.
+    digest = hashlib.blake2b(identifier.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "little") % buckets
+
+
+# --- Partition workers ---
+
+def cluster_chunk(
+    chunk_index: int, rows: List[Tuple[int, Optional[str], Optional[str]]], spill_dir: str, buckets: int
+) -> array:
+    """
+    Union-finds one chunk of (id, email, phoneNumber) rows locally. Writes the
+    (identifier, local root) pairs of the chunk to one spill file per bucket
+    and returns the flattened (id, local root) pairs of every row that is
+    not its own root. Identifiers are "email:<value>" / "phone:<value>".
+    """
+    parent = {contact_id: contact_id for contact_id, _, _ in rows}
+
+    def local_find(node):
+        while parent[node] != node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+
+    first_seen = {}
+    for contact_id, email, phone_number in rows:
+        for kind, value in (("email", email), ("phone", phone_number)):
+            if not value:
+                continue
+            other = first_seen.setdefault(f"{kind}:{value}", contact_id)
+            if other != contact_id:
+                root_a, root_b = local_find(other), local_find(contact_id)
+                if root_a != root_b:
+                    parent[max(root_a, root_b)] = min(root_a, root_b)
+
+    spills = [[] for _ in range(buckets)]
+    for identifier, contact_id in first_seen.items():
+        spills[identifier_bucket(identifier, buckets)].append((identifier, local_find(contact_id)))
+    for bucket, pairs in enumerate(spills):
+        if pairs:
+            with open(os.path.join(spill_dir, f"b{bucket:04d}-c{chunk_index:07d}.bin"), "wb") as f:
+                pickle.dump(pairs, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    edges = array("q")
+    for contact_id in parent:
+        root = local_find(contact_id)
+        if root != contact_id:
+            edges.extend((contact_id, root))
+    return edges
+
+
+# --- Driver ---
+
+def recluster(chunk_size: int, workers: int, buckets: int, keep_links: bool, dry_run: bool) -> None:
+    started = time.perf_counter()
+    table = Contact.__table__
+
+    with main.engine.connect() as conn:
+        max_id = conn.execute(select(func.max(table.c.id))).scalar() or 0
+    size = max_id + 1
+
+    parent = array("q", range(size))
+    created = array("d", bytes(8 * size))
+    current_link = array("q", bytes(8 * size))
+    marked_primary = bytearray(size)
+    present = bytearray(size)
+
+    spill_dir = tempfile.mkdtemp(prefix="recluster-")
+    with ProcessPoolExecutor(max_workers=workers) as pool, main.engine.connect() as conn:
+        # 1. Stream chunks to the pool, keeping a bounded number in flight
+        rows = conn.execution_options(yield_per=chunk_size).execute(
+            select(
+                table.c.id, table.c.email, table.c.phoneNumber, table.c.createdAt,
+                table.c.linkedId, table.c.linkPrecedence,
+            )
+            .order_by(table.c.id)
+        )
+        in_flight = []
+        chunk_count = 0
+        for partition in rows.partitions():
+            chunk = []
+            for contact_id, email, phone_number, created_at, linked_id, precedence in partition:
+                present[contact_id] = 1
+                marked_primary[contact_id] = precedence == LinkPrecedence.primary
+                created[contact_id] = created_seconds(created_at)
+                current_link[contact_id] = linked_id or NULL_ID
+                if linked_id and keep_links:
+                    union(parent, contact_id, linked_id)
+                chunk.append((contact_id, email, phone_number))
+            in_flight.append(pool.submit(cluster_chunk, chunk_count, chunk, spill_dir, buckets))
+            chunk_count += 1
+            while len(in_flight) >= 2 * workers:
+                apply_edges(parent, in_flight.pop(0).result())
+        for future in in_flight:
+            apply_edges(parent, future.result())
+
+    # 2. Merge partitions: identifiers seen by several chunks join their roots
+    for bucket in range(buckets):
+        roots = {}
+        prefix = f"b{bucket:04d}-"
+        for name in sorted(n for n in os.listdir(spill_dir) if n.startswith(prefix)):
+            path = os.path.join(spill_dir, name)
+            with open(path, "rb") as f:
+                pairs = pickle.load(f)
+            os.remove(path)
+            for identifier, root in pairs:
+                known = roots.setdefault(identifier, root)
+                if known != root:
+                    union(parent, known, root)
+    os.rmdir(spill_dir)
+
+    # 3. Elect the oldest contact of each group as its primary
+    primary = array("q", bytes(8 * size))
+    for contact_id in range(1, size):
+        if present[contact_id]:
+            root = find(parent, contact_id)
+            best = primary[root]
+            if best == NULL_ID or (created[contact_id], contact_id) < (created[best], best):
+                primary[root] = contact_id
+
+    # 4. Write back only the rows whose link changed
+    changes = []
+    groups = 0
+    for contact_id in range(1, size):
+        if not present[contact_id]:
+            continue
+        elected = primary[find(parent, contact_id)]
+        linked_id = NULL_ID if elected == contact_id else elected
+        groups += linked_id == NULL_ID
+        if linked_id != current_link[contact_id] or marked_primary[contact_id] != (linked_id == NULL_ID):
+            changes.append(contact_id)
+
+    print(f"{sum(present)} contacts, {groups} identity groups, {len(changes)} links to update")
+    if dry_run:
+        return
+
+    stmt = (
+        update(table)
+        .where(table.c.id == bindparam("contact_id"))
+        .values(linkedId=bindparam("new_linked_id"), linkPrecedence=bindparam("new_precedence"))
+    )
+    with main.engine.begin() as conn:
+        for start in range(0, len(changes), 10000):
+            batch = []
+            for contact_id in changes[start:start + 10000]:
+                elected = primary[find(parent, contact_id)]
+                is_primary = elected == contact_id
+                batch.append({
+                    "contact_id": contact_id,
+                    "new_linked_id": None if is_primary else elected,
+                    "new_precedence": LinkPrecedence.primary if is_primary else LinkPrecedence.secondary,
+                })
+            conn.execute(stmt, batch)
+
+    with main.SessionLocal() as db:
+        main.rebuild_identity_clusters(db)
+    print(f"done in {time.perf_counter() - started:.1f}s")
+
+
+def apply_edges(parent: array, edges: array) -> None:
+    for i in range(0, len(edges), 2):
+        union(parent, edges[i], edges[i + 1])
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunk-size", type=int, default=200000, help="contacts per partition")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="worker processes")
+    parser.add_argument("--buckets", type=int, default=64, help="identifier hash buckets spilled to disk")
+    parser.add_argument("--ignore-links", action="store_true", help="group by shared identifiers only")
+    parser.add_argument("--dry-run", action="store_true", help="report the changes without writing them")
+    args = parser.parse_args()
+    recluster(args.chunk_size, args.workers, args.buckets, not args.ignore_links, args.dry_run)
+
+
+if __name__ == "__main__":
+    main_cli()